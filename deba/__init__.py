@@ -1,7 +1,5 @@
 import pathlib
 
-from deba.config import get_config
-
 _root = None
 
 
@@ -30,5 +28,7 @@ def data(filepath: str) -> pathlib.Path:
 
     :rtype: str
     """
+    from deba.config import get_config
+
     conf = get_config(_root)
     return pathlib.Path(conf._root_dir) / conf.data_dir / filepath.lstrip("/")
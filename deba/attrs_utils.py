@@ -1,6 +1,6 @@
+import sys
 import typing
 
-import zope.interface
 from attrs import resolve_types, validators, field, NOTHING, setters
 
 
@@ -23,11 +23,18 @@ def _union_type_validator(types):
     return check
 
 
+def _is_interface(t) -> bool:
+    # an interface can only exist once zope.interface has been imported, so
+    # don't pay for importing it just to find out that t isn't one
+    interface = sys.modules.get("zope.interface.interface")
+    return interface is not None and type(t) is interface.InterfaceClass
+
+
 def _type_validator(t):
     original_type = getattr(t, "__origin__", None)
     if type(t) is type:
         return validators.instance_of(t)
-    elif type(t) is zope.interface.interface.InterfaceClass:
+    elif _is_interface(t):
         return validators.provides(t)
     elif original_type is list or original_type is typing.List:
         return validators.deep_iterable(member_validator=_type_validator(t.__args__[0]))
@@ -0,0 +1,56 @@
+"""Thin client for a running `deba serve`.
+
+This module must stay cheap to import: it only uses the standard library and
+falls back to running the command in-process when no server is listening.
+"""
+import json
+import os
+import socket
+import sys
+import typing
+
+SOCKET_PATH = os.path.join(".deba", "deba.sock")
+
+
+def request(
+    argv: typing.List[str], socket_path: str = SOCKET_PATH
+) -> typing.Union[typing.Dict, None]:
+    """Sends argv to the server listening on socket_path.
+
+    Returns the server response, or None if there is no server or the server
+    declined to run the command.
+    """
+    if not os.path.exists(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"argv": argv}).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    except OSError:
+        return None
+    finally:
+        sock.close()
+    if not line:
+        return None
+    resp = json.loads(line.decode("utf-8"))
+    if resp.get("fallback"):
+        return None
+    return resp
+
+
+def main():
+    resp = request(sys.argv[1:])
+    if resp is None:
+        from deba.commands import exec
+
+        exec()
+        return
+    sys.stdout.write(resp["stdout"])
+    sys.stderr.write(resp["stderr"])
+    sys.exit(resp["status"])
+
+
+if __name__ == "__main__":
+    main()
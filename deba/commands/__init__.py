@@ -1,22 +1,52 @@
 import argparse
+import importlib
 import logging
-
-from .init import add_subcommand as add_init_command
-from .data_dir import add_subcommand as add_data_dir_command
-from .deps import add_subcommand as add_deps_command
-from .stages import add_subcommand as add_stages_command
-from .targets import add_subcommand as add_targets_command
-from .python_path import add_subcommand as add_python_path_command
-from .test import add_subcommand as add_test_command
-from .md5_dir import add_subcommand as add_md5_command
-from .debug import add_subcommand as add_debug_command
-from .ast import add_subcommand as add_ast_command
+import sys
+import typing
 
 
 logger = logging.getLogger("deba")
 
+# Subcommand name -> (module under deba.commands, help text). Modules are
+# only imported when their subcommand is dispatched so that trivial
+# commands don't pay for the analysis stack.
+SUBCOMMANDS = {
+    "init": ("init", "initialize deba config in the current folder"),
+    "dataDir": ("data_dir", "print dataDir"),
+    "deps": ("deps", "write make rules"),
+    "stages": ("stages", "print stage names"),
+    "targets": ("targets", "print targets"),
+    "pythonPath": ("python_path", "print pythonPath"),
+    "test": ("test", "test a pattern against a function call"),
+    "md5Dir": ("md5_dir", "print md5Dir"),
+    "md5": ("md5", "write md5 checksums of files into md5Dir"),
+    "debug": ("debug", "print prerequisites and targets from a single script"),
+    "ast": ("ast", "pretty print SCRIPT ast"),
+    "makeVars": (
+        "make_vars",
+        "print all DEBA_* make variables and write them to .deba/vars.mk, along with fingerprints of the settings of each stage",
+    ),
+    "serve": (
+        "serve",
+        "keep analysis warm and answer commands sent by `python -m deba.client`",
+    ),
+}
+
+
+def dispatched_command(argv: typing.List[str]) -> typing.Union[str, None]:
+    for arg in argv:
+        if not arg.startswith("-"):
+            return arg
+
+
+def get_parser(
+    argv: typing.Union[typing.List[str], None] = None
+) -> argparse.ArgumentParser:
+    """Builds the command line parser.
 
-def get_parser() -> argparse.ArgumentParser:
+    If argv is given, only the subcommand found in argv is imported, other
+    subcommands are registered with their name and help text only.
+    """
     parser = argparse.ArgumentParser(
         "deba", description="discover proper order of execution"
     )
@@ -26,23 +56,24 @@ def get_parser() -> argparse.ArgumentParser:
         "-v", "--verbose", action="store_true", help="increase output verbosity"
     )
 
+    cmd = None if argv is None else dispatched_command(argv)
     subparsers = parser.add_subparsers()
-    add_init_command(subparsers, common_parser)
-    add_data_dir_command(subparsers, common_parser)
-    add_deps_command(subparsers, common_parser)
-    add_stages_command(subparsers, common_parser)
-    add_targets_command(subparsers, common_parser)
-    add_python_path_command(subparsers, common_parser)
-    add_test_command(subparsers, common_parser)
-    add_md5_command(subparsers, common_parser)
-    add_debug_command(subparsers, common_parser)
-    add_ast_command(subparsers, common_parser)
+    for name, (module_name, help) in SUBCOMMANDS.items():
+        if argv is None or name == cmd:
+            module = importlib.import_module("deba.commands.%s" % module_name)
+            module.add_subcommand(subparsers, common_parser)
+        else:
+            subparsers.add_parser(name=name, help=help, add_help=False)
     return parser
 
 
 def exec():
-    parser = get_parser()
-    args = parser.parse_args()
+    argv = sys.argv[1:]
+    parser = get_parser(argv)
+    args = parser.parse_args(argv)
+    if not hasattr(args, "exec"):
+        parser.print_help()
+        sys.exit(1)
 
     ch = logging.StreamHandler()
     formatter = logging.Formatter(
@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from deba.commands import SUBCOMMANDS, get_parser
+from deba.test_utils import TempDirMixin
+
+# cumulative import time allowed for `deba dataDir`, in microseconds
+DATA_DIR_IMPORT_BUDGET = 500000
+
+
+def import_times(stderr: str):
+    """Parses -X importtime output into (module, cumulative us, nested) tuples"""
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        yield name.strip(), int(cumulative), name.startswith("  ")
+
+
+class LazyRegistryTestCase(TempDirMixin, unittest.TestCase):
+    def test_get_parser(self):
+        parser = get_parser()
+        subparsers = parser._subparsers._group_actions[0]
+        self.assertEqual(set(subparsers.choices.keys()), set(SUBCOMMANDS.keys()))
+
+        args = get_parser(["stages"]).parse_args(["stages"])
+        self.assertTrue(hasattr(args, "exec"))
+
+    def test_data_dir_cold_start(self):
+        self.write_file("deba.yaml", ["stages:", "  - name: clean", ""])
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.dirname(__file__)))]
+            + [p for p in [env.get("PYTHONPATH")] if p]
+        )
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", "deba", "dataDir"],
+            cwd=self._dir.name,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertEqual(proc.stdout, "data\n")
+
+        times = list(import_times(proc.stderr))
+        modules = set(name for name, _, _ in times)
+        for name in [
+            "astpretty",
+            "zope.interface",
+            "deba.deps.find",
+            "deba.deps.module",
+            "deba.commands.deps",
+            "deba.commands.ast",
+        ]:
+            self.assertNotIn(name, modules)
+        total = sum(
+            cumulative
+            for name, cumulative, nested in times
+            if not nested and name.split(".")[0] == "deba"
+        )
+        self.assertLess(total, DATA_DIR_IMPORT_BUDGET)
@@ -4,7 +4,7 @@ import logging
 from deba.commands.decorators import subcommand
 from deba.config import Config
 
-from deba.deps.module import Loader
+from deba.deps.module import new_loader
 from deba.deps.find import find_dependencies
 
 
@@ -12,7 +12,7 @@ logger = logging.getLogger("deba")
 
 
 def exec(conf: Config, args: argparse.Namespace):
-    loader = Loader(conf.script_search_paths)
+    loader = new_loader(conf)
     logger.setLevel(logging.DEBUG)
     prerequisites, references, targets = find_dependencies(
         loader,
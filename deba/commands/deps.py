@@ -1,15 +1,26 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 import io
+import itertools
 import json
 import os
 import logging
 import typing
 
 from deba.commands.decorators import subcommand
-from deba.config import Config, Stage
+from deba.config import Config, Opaque, Stage
 
-from deba.deps.module import Loader
-from deba.deps.find import find_dependencies
+from deba.deps.analysis import (
+    AnalysisCache,
+    ScriptAnalysis,
+    analysis_key,
+    analyze_script,
+)
+from deba.deps.cache import ASTCache
+from deba.deps.expr import PatternIndex
+from deba.deps.module import Loader, SpecIndex, new_loader
+from deba.deps.prefilter import Prefilter
+from deba.file_utils import write_if_changed
 
 
 logger = logging.getLogger("deba")
@@ -74,20 +85,254 @@ def validate_targets(
             )
 
 
+def _patterns(conf: Config):
+    return (
+        conf.patterns.prerequisites or [],
+        conf.patterns.references or [],
+        conf.patterns.targets or [],
+    )
+
+
+def _pattern_indexes(conf: Config) -> typing.Tuple[PatternIndex, ...]:
+    return tuple(PatternIndex(pats) for pats in _patterns(conf))
+
+
+# state of a worker process, set up once by _init_worker
+_worker_state = dict()
+
+
+def _new_prefilter(conf: Config, prefilter: bool) -> typing.Union[Prefilter, None]:
+    if not prefilter:
+        return None
+    return Prefilter.from_patterns(itertools.chain(*_patterns(conf)))
+
+
+def _counters(
+    specs: SpecIndex, prefilter: typing.Union[Prefilter, None]
+) -> typing.Tuple[int, ...]:
+    counters = (specs.hits, specs.misses, specs.skipped)
+    if prefilter is None:
+        return counters + (0, 0)
+    return counters + (prefilter.bodies, prefilter.skipped)
+
+
+def _add_counters(
+    specs: SpecIndex, prefilter: typing.Union[Prefilter, None], counters: typing.Tuple
+):
+    specs.hits += counters[0]
+    specs.misses += counters[1]
+    specs.skipped += counters[2]
+    if prefilter is not None:
+        prefilter.bodies += counters[3]
+        prefilter.skipped += counters[4]
+
+
+def _log_summaries(specs: SpecIndex, prefilter: typing.Union[Prefilter, None]):
+    logger.info("%s", specs.summary())
+    if prefilter is not None:
+        logger.info("%s", prefilter.summary())
+
+
+class _WorkerScriptFilter(logging.Filter):
+    """Adds the script a worker is analyzing to its log records."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.script = _worker_state.get("script", "-")
+        return True
+
+
+def _init_worker(
+    conf: Config,
+    indexes: typing.Tuple[PatternIndex, ...],
+    max_memory: typing.Union[int, None],
+    prefilter: bool,
+    log_level: int,
+):
+    # handlers inherited from a forked parent would print records without
+    # their script, and spawned workers have none at all
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(script)s - %(message)s"
+        )
+    )
+    handler.addFilter(_WorkerScriptFilter())
+    logger.handlers = [handler]
+    logger.setLevel(log_level)
+
+    _worker_state["loader"] = new_loader(conf, max_memory)
+    _worker_state["indexes"] = indexes
+    _worker_state["states"] = dict()
+    _worker_state["prefilter"] = _new_prefilter(conf, prefilter)
+
+
+def _analyze_in_worker(
+    script_path: str,
+) -> typing.Tuple[ScriptAnalysis, typing.Tuple[int, ...]]:
+    """Analyzes a script, also returning how much the worker counters went up."""
+    loader, prefilter = _worker_state["loader"], _worker_state["prefilter"]
+    before = _counters(loader.specs, prefilter)
+    _worker_state["script"] = script_path
+    try:
+        result = analyze_script(
+            loader,
+            script_path,
+            *_worker_state["indexes"],
+            states=_worker_state["states"],
+            prefilter=prefilter,
+        )
+    finally:
+        _worker_state.pop("script")
+    loader.evict(script_path)
+    return result, tuple(
+        n - m for n, m in zip(_counters(loader.specs, prefilter), before)
+    )
+
+
+def _analyze_scripts(
+    conf: Config,
+    loader: typing.Union[Loader, None],
+    script_paths: typing.List[str],
+    jobs: int,
+    max_memory: typing.Union[int, None] = None,
+    prefilter: bool = False,
+) -> typing.Iterator[typing.Tuple[str, ScriptAnalysis]]:
+    """Analyzes scripts, in a pool of jobs processes if there are enough of them.
+
+    Results are yielded in the order of script_paths. Each process keeps its
+    parsed modules within max_memory bytes, if given, and skips pattern tests
+    in bodies that can't match them if prefilter is set. Patterns are indexed
+    once and shared by every script. Lookup and prefilter counters of all
+    processes are added up and logged at the end.
+    """
+    indexes = _pattern_indexes(conf)
+    if jobs > 1 and len(script_paths) > 1 and loader is None:
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(script_paths)),
+            initializer=_init_worker,
+            initargs=(
+                conf,
+                indexes,
+                max_memory,
+                prefilter,
+                logger.getEffectiveLevel(),
+            ),
+        ) as executor:
+            futures = [
+                (script_path, executor.submit(_analyze_in_worker, script_path))
+                for script_path in script_paths
+            ]
+            totals = SpecIndex(), _new_prefilter(conf, prefilter)
+            for script_path, future in futures:
+                try:
+                    result, counters = future.result()
+                except Exception:
+                    print("    error analyzing script %s" % script_path)
+                    raise
+                _add_counters(*totals, counters)
+                yield script_path, result
+        _log_summaries(*totals)
+        return
+
+    if loader is None:
+        loader = new_loader(conf, max_memory)
+    states = dict()
+    prefilter = _new_prefilter(conf, prefilter)
+    for script_path in script_paths:
+        try:
+            result = analyze_script(
+                loader, script_path, *indexes, states=states, prefilter=prefilter
+            )
+        except Exception:
+            print("    error analyzing script %s" % script_path)
+            raise
+        loader.evict(script_path)
+        yield script_path, result
+    if script_paths:
+        _log_summaries(loader.specs, prefilter)
+
+
+def analyze_stages(
+    conf: Config,
+    stages: typing.List[Stage],
+    loader: typing.Union[Loader, None] = None,
+    jobs: int = 1,
+    max_memory: typing.Union[int, None] = None,
+    prefilter: bool = False,
+) -> typing.List[typing.List[typing.Tuple[str, ScriptAnalysis]]]:
+    """Analyzes scripts in stages, reusing results of scripts whose inputs didn't change.
+
+    Scripts of all stages that need to be analyzed again are analyzed together
+    so that modules they share are only loaded once. They are spread over jobs
+    processes unless a loader is given, in which case they are analyzed with
+    it one by one so that its modules stay warm. Otherwise parsed modules are
+    kept within max_memory bytes per process, if given. See _analyze_scripts
+    for prefilter.
+    """
+    opaque = conf.opaque or Opaque()
+    key = analysis_key(
+        conf.script_search_paths,
+        *_patterns(conf),
+        opaque.modules,
+        opaque.abs_paths(conf._root_dir),
+    )
+    caches, stage_scripts, scripts = [], [], dict()
+    for stage in stages:
+        cache = AnalysisCache.load(stage.analysis_filepath, key)
+        caches.append(cache)
+        stage_scripts.append(list(stage.scripts()))
+        for _, script_path in stage_scripts[-1]:
+            scripts[script_path] = cache.get(script_path)
+            if scripts[script_path] is not None:
+                logger.info("%s unchanged, reusing analysis", script_path)
+    stale = [script_path for script_path, result in scripts.items() if result is None]
+    for script_path, result in _analyze_scripts(
+        conf, loader, stale, jobs, max_memory, prefilter
+    ):
+        scripts[script_path] = result
+
+    results = []
+    for cache, names in zip(caches, stage_scripts):
+        cache.save({script_path: scripts[script_path] for _, script_path in names})
+        results.append(
+            [(script_name, scripts[script_path]) for script_name, script_path in names]
+        )
+    return results
+
+
+def analyze_stage(
+    conf: Config,
+    stage: Stage,
+    loader: typing.Union[Loader, None] = None,
+    jobs: int = 1,
+    max_memory: typing.Union[int, None] = None,
+    prefilter: bool = False,
+) -> typing.List[typing.Tuple[str, ScriptAnalysis]]:
+    """Analyzes scripts in a stage, see analyze_stages."""
+    return analyze_stages(conf, [stage], loader, jobs, max_memory, prefilter)[0]
+
+
+def local_modules(conf: Config, origins: typing.Iterable[str]) -> typing.List[str]:
+    """Returns paths relative to the root directory of modules located under it."""
+    paths = []
+    for origin in origins:
+        rel_path = os.path.relpath(origin, conf._root_dir)
+        if not rel_path.startswith(os.pardir):
+            paths.append(rel_path)
+    return paths
+
+
 def write_deps(
     conf: Config,
     stage: Stage,
-    loader: Loader,
-    deps_file: io.TextIOWrapper,
+    deps_file: typing.TextIO,
     script_name: str,
-    script_path: str,
+    result: ScriptAnalysis,
 ):
-    prerequisites, references, targets = find_dependencies(
-        loader,
-        script_path,
-        conf.patterns.prerequisites or [],
-        conf.patterns.references or [],
-        conf.patterns.targets or [],
+    prerequisites, references, targets = (
+        result.prerequisites,
+        result.references,
+        result.targets,
     )
 
     if stage.ignored_targets is not None:
@@ -106,33 +351,35 @@ def write_deps(
         print("    no prerequisite or reference, skipping script %s" % script_name)
         return
 
-    if conf.overrides is not None:
-        for idx, exec_rule in enumerate(conf.overrides):
-            if exec_rule.target_set == set(targets):
-                print(
-                    "    override #%d matches targets, skipping script %s"
-                    % (idx, script_name)
-                )
-                return
+    override = conf.get_override(targets)
+    if override is not None:
+        print(
+            "    override #%d matches targets, skipping script %s"
+            % (override[0], script_name)
+        )
+        return
 
     # write rule for this script
+    md5_sources = (
+        [rel_script_path]
+        + references
+        + (
+            [str(p) for p in stage.common_prerequisites]
+            if stage.common_prerequisites is not None
+            else []
+        )
+        + local_modules(conf, result.modules)
+    )
     targets = " ".join(["$(DEBA_DATA_DIR)/%s" % name for name in targets])
+    deps_file.write("DEBA_MD5_SOURCES += %s\n" % " ".join(md5_sources))
     deps_file.write(
         "%s &: %s %s | $(DEBA_DATA_DIR)/%s\n\t$(call deba_execute,%s)\n\n"
         % (
             targets,
             "$(DEBA_MD5_DIR)/%s.md5" % (rel_script_path),
             " ".join(
-                ["$(DEBA_DATA_DIR)/%s" % name for name in prerequisites]
-                + ["$(DEBA_MD5_DIR)/%s.md5" % name for name in references]
-                + (
-                    [
-                        "$(DEBA_MD5_DIR)/%s.md5" % str(p)
-                        for p in stage.common_prerequisites
-                    ]
-                    if stage.common_prerequisites is not None
-                    else []
-                )
+                ["$(DEBA_DATA_MD5_DIR)/%s.md5" % name for name in prerequisites]
+                + ["$(DEBA_MD5_DIR)/%s.md5" % name for name in md5_sources[1:]]
             ),
             stage.name,
             rel_script_path,
@@ -140,9 +387,66 @@ def write_deps(
     )
 
 
+def write_stage_deps(
+    conf: Config,
+    stage: Stage,
+    results: typing.List[typing.Tuple[str, ScriptAnalysis]],
+):
+    """Writes rules of a stage, leaving the file untouched if they didn't change.
+
+    Make restarts whenever an included file gets newer, so rewriting identical
+    rules would re-read every makefile for nothing.
+    """
+    f = io.StringIO()
+    # local modules that analyses read besides the scripts themselves, deps
+    # reruns when they change
+    sources = set()
+    for script_name, result in results:
+        rel_script_path = os.path.join(stage.name, script_name)
+        sources.update(
+            rel_path
+            for rel_path in local_modules(conf, result.inputs)
+            if rel_path != rel_script_path
+        )
+    if sources:
+        f.write("DEBA_DEPS_SOURCES += %s\n\n" % " ".join(sorted(sources)))
+    # write rule for data dir
+    f.write("$(DEBA_DATA_DIR)/%s: ; @-mkdir -p $@ 2>/dev/null\n\n" % (stage.name))
+
+    for script_name, result in results:
+        write_deps(conf, stage, f, script_name, result)
+    write_if_changed(stage.deps_filepath, f.getvalue())
+
+
+def write_main_deps(conf: Config):
+    f = io.StringIO()
+    if conf.overrides is not None:
+        for rule in conf.overrides:
+            f.write(
+                "%s &: %s\n\t%s\n\n"
+                % (
+                    rule.target_str,
+                    " ".join(rule.prerequisites),
+                    rule.recipe,
+                )
+            )
+    write_if_changed(conf.main_deps_filepath, f.getvalue())
+
+
 def exec(conf: Config, args: argparse.Namespace):
-    if args.stage != "":
-        loader = Loader(conf.script_search_paths)
+    loader = getattr(args, "loader", None)
+    max_memory = None if args.max_memory is None else args.max_memory * (1 << 20)
+    if args.all:
+        for stage, results in zip(
+            conf.stages,
+            analyze_stages(
+                conf, conf.stages, loader, args.jobs, max_memory, args.prefilter
+            ),
+        ):
+            print("  stage %s" % stage.name)
+            write_stage_deps(conf, stage, results)
+        write_main_deps(conf)
+    elif args.stage != "":
         stage = conf.get_stage(args.stage)
         if stage is None:
             raise ValueError(
@@ -150,28 +454,16 @@ def exec(conf: Config, args: argparse.Namespace):
                 json.dumps(args.stage),
                 json.dumps([st.name for st in conf.stages]),
             )
-        os.makedirs(conf.deps_dir, exist_ok=True)
-        with open(stage.deps_filepath, "w") as f:
-            # write rule for data dir
-            f.write(
-                "$(DEBA_DATA_DIR)/%s: ; @-mkdir -p $@ 2>/dev/null\n\n" % (stage.name)
-            )
-
-            for script_name, script_path in stage.scripts():
-                write_deps(conf, stage, loader, f, script_name, script_path)
+        write_stage_deps(
+            conf,
+            stage,
+            analyze_stage(conf, stage, loader, args.jobs, max_memory, args.prefilter),
+        )
     else:
-        os.makedirs(conf.deba_dir, exist_ok=True)
-        with open(conf.main_deps_filepath, "w") as f:
-            if conf.overrides is not None:
-                for rule in conf.overrides:
-                    f.write(
-                        "%s &: %s\n\t%s\n\n"
-                        % (
-                            rule.target_str,
-                            " ".join(rule.prerequisites),
-                            rule.recipe,
-                        )
-                    )
+        write_main_deps(conf)
+    removed = ASTCache(conf.cache_dir).prune()
+    if removed:
+        logger.info("pruned %d unused entries from the module cache", removed)
 
 
 @subcommand(exec=exec)
@@ -183,10 +475,35 @@ def add_subcommand(
         parents=[parent_parser],
         description="write make rules",
     )
-    parser.add_argument(
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
         "--stage",
         type=str,
         default="",
         help="if specified, analyze and write make rules for scripts in this stage. Otherwise, write overriden make rules.",
     )
+    group.add_argument(
+        "--all",
+        action="store_true",
+        help="analyze and write make rules for scripts in every stage as well as overriden make rules, sharing loaded modules between stages",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes used to analyze scripts, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=None,
+        metavar="MB",
+        help="keep parsed modules of each analyzing process within roughly this many megabytes, parsing evicted modules again when needed. Unbounded by default.",
+    )
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        help="search source files for the callee names of patterns before testing calls against them, skipping the tests in function bodies that mention none of these names",
+    )
     return parser
@@ -1,9 +1,19 @@
+import io
+import logging
+import os
+import shutil
 import unittest
+from unittest.mock import patch
+from contextlib import redirect_stderr, redirect_stdout
 import argparse
 
+from deba.commands import deps
 from deba.commands.deps import add_subcommand
+from deba.deps.analysis import analyze_script
+from deba.deps.find import ModuleParseError
+from deba.deps.module import new_loader
 from deba.config import Config, ExecutionRule, Stage
-from deba.deps.expr import ExprPatterns
+from deba.deps.expr import ExprPatterns, PatternIndex
 from deba.test_utils import TempDirMixin
 from deba.test_utils import subcommand_testcase, CommandTestCaseMixin
 
@@ -95,7 +105,8 @@ class DepsCommandTestCase(CommandTestCaseMixin, TempDirMixin, unittest.TestCase)
             [
                 "$(DEBA_DATA_DIR)/clean: ; @-mkdir -p $@ 2>/dev/null",
                 "",
-                "$(DEBA_DATA_DIR)/clean/a_output.csv &: $(DEBA_MD5_DIR)/clean/a.py.md5 $(DEBA_DATA_DIR)/raw/a_input.csv | $(DEBA_DATA_DIR)/clean",
+                "DEBA_MD5_SOURCES += clean/a.py",
+                "$(DEBA_DATA_DIR)/clean/a_output.csv &: $(DEBA_MD5_DIR)/clean/a.py.md5 $(DEBA_DATA_MD5_DIR)/raw/a_input.csv.md5 | $(DEBA_DATA_DIR)/clean",
                 "\t$(call deba_execute,clean/a.py)",
                 "",
                 "",
@@ -109,9 +120,11 @@ class DepsCommandTestCase(CommandTestCaseMixin, TempDirMixin, unittest.TestCase)
             [
                 "$(DEBA_DATA_DIR)/fuse: ; @-mkdir -p $@ 2>/dev/null",
                 "",
-                "$(DEBA_DATA_DIR)/fuse/data.csv &: $(DEBA_MD5_DIR)/fuse/a.py.md5 $(DEBA_DATA_DIR)/clean/b_output.csv | $(DEBA_DATA_DIR)/fuse",
+                "DEBA_MD5_SOURCES += fuse/a.py",
+                "$(DEBA_DATA_DIR)/fuse/data.csv &: $(DEBA_MD5_DIR)/fuse/a.py.md5 $(DEBA_DATA_MD5_DIR)/clean/b_output.csv.md5 | $(DEBA_DATA_DIR)/fuse",
                 "\t$(call deba_execute,fuse/a.py)",
                 "",
+                "DEBA_MD5_SOURCES += fuse/b.py my_config.json",
                 "$(DEBA_DATA_DIR)/fuse/data_b.csv &: $(DEBA_MD5_DIR)/fuse/b.py.md5 $(DEBA_MD5_DIR)/my_config.json.md5 | $(DEBA_DATA_DIR)/fuse",
                 "\t$(call deba_execute,fuse/b.py)",
                 "",
@@ -134,6 +147,19 @@ class DepsCommandTestCase(CommandTestCaseMixin, TempDirMixin, unittest.TestCase)
             ],
         )
 
+        outputs = dict()
+        for filename in [".deba/deps/clean.d", ".deba/deps/fuse.d", ".deba/main.d"]:
+            with open(self.file_path(filename), "r") as f:
+                outputs[filename] = f.read()
+        shutil.rmtree(self.file_path(".deba"))
+
+        with patch("deba.commands.deps.new_loader", wraps=new_loader) as mock_loader:
+            self.exec(conf, "deps", "--all", "--jobs", "1")
+        mock_loader.assert_called_once()
+        for filename, content in outputs.items():
+            with open(self.file_path(filename), "r") as f:
+                self.assertEqual(f.read(), content, filename)
+
     def test_skip_scripts_with_no_target(self):
         conf = Config(
             stages=[
@@ -177,9 +203,233 @@ class DepsCommandTestCase(CommandTestCaseMixin, TempDirMixin, unittest.TestCase)
             [
                 "$(DEBA_DATA_DIR)/fuse: ; @-mkdir -p $@ 2>/dev/null",
                 "",
-                "$(DEBA_DATA_DIR)/fuse/d_output.csv &: $(DEBA_MD5_DIR)/fuse/c.py.md5 $(DEBA_DATA_DIR)/raw/d_input.csv | $(DEBA_DATA_DIR)/fuse",
+                "DEBA_MD5_SOURCES += fuse/c.py",
+                "$(DEBA_DATA_DIR)/fuse/d_output.csv &: $(DEBA_MD5_DIR)/fuse/c.py.md5 $(DEBA_DATA_MD5_DIR)/raw/d_input.csv.md5 | $(DEBA_DATA_DIR)/fuse",
                 "	$(call deba_execute,fuse/c.py)",
                 "",
                 "",
             ],
         )
+
+    def test_reuse_analysis_of_unchanged_scripts(self):
+        conf = Config(
+            stages=[Stage(name="clean")],
+            patterns=ExprPatterns(
+                prerequisites=[r'read_csv(".+\\.csv")'],
+                targets=[r'`*`.to_csv(".+\\.csv")'],
+            ),
+            root_dir=self._dir.name,
+        )
+        for name in ["a", "b"]:
+            self.write_file(
+                "clean/%s.py" % name,
+                [
+                    'if __name__ == "__main__":',
+                    '  df = read_csv("raw/%s_input.csv")' % name,
+                    '  df.to_csv("clean/%s_output.csv")' % name,
+                ],
+            )
+
+        with patch(
+            "deba.commands.deps.analyze_script", wraps=analyze_script
+        ) as mock_analyze, patch(
+            "deba.commands.deps.PatternIndex", wraps=PatternIndex
+        ) as mock_index:
+            self.exec(conf, "deps", "--stage", "clean", "--jobs", "1")
+            self.assertEqual(mock_analyze.call_count, 2)
+            # one index per kind of pattern, shared by both scripts
+            self.assertEqual(mock_index.call_count, 3)
+            mtime = self.mod_time(".deba/deps/clean.d")
+
+            # identical rules are not written again
+            mock_analyze.reset_mock()
+            self.exec(conf, "deps", "--stage", "clean", "--jobs", "1")
+            mock_analyze.assert_not_called()
+            self.assertFileNotModifiedSince(".deba/deps/clean.d", mtime)
+
+            self.write_file(
+                "clean/b.py",
+                [
+                    'if __name__ == "__main__":',
+                    '  df = read_csv("raw/b_new_input.csv")',
+                    '  df.to_csv("clean/b_output.csv")',
+                ],
+            )
+            self.exec(conf, "deps", "--stage", "clean", "--jobs", "1")
+            self.assertEqual(
+                [c.args[1] for c in mock_analyze.call_args_list],
+                [self.file_path("clean/b.py")],
+            )
+
+        self.assertFileContent(
+            ".deba/deps/clean.d",
+            [
+                "$(DEBA_DATA_DIR)/clean: ; @-mkdir -p $@ 2>/dev/null",
+                "",
+                "DEBA_MD5_SOURCES += clean/a.py",
+                "$(DEBA_DATA_DIR)/clean/a_output.csv &: $(DEBA_MD5_DIR)/clean/a.py.md5 $(DEBA_DATA_MD5_DIR)/raw/a_input.csv.md5 | $(DEBA_DATA_DIR)/clean",
+                "\t$(call deba_execute,clean/a.py)",
+                "",
+                "DEBA_MD5_SOURCES += clean/b.py",
+                "$(DEBA_DATA_DIR)/clean/b_output.csv &: $(DEBA_MD5_DIR)/clean/b.py.md5 $(DEBA_DATA_MD5_DIR)/raw/b_new_input.csv.md5 | $(DEBA_DATA_DIR)/clean",
+                "\t$(call deba_execute,clean/b.py)",
+                "",
+                "",
+            ],
+        )
+
+    def _write_stage_scripts(self, n: int):
+        for i in range(n):
+            self.write_file(
+                "clean/s%d.py" % i,
+                [
+                    'if __name__ == "__main__":',
+                    '  df = read_csv("raw/in_%d.csv")' % i,
+                    '  df.to_csv("clean/out_%d.csv")' % i,
+                    '  df.to_csv("clean/out_%d.csv")' % (i % 3),
+                ],
+            )
+
+    def test_parallel_analysis(self):
+        conf = Config(
+            stages=[Stage(name="clean")],
+            patterns=ExprPatterns(
+                prerequisites=[r'read_csv(".+\\.csv")'],
+                targets=[r'`*`.to_csv(".+\\.csv")'],
+            ),
+            root_dir=self._dir.name,
+        )
+        self._write_stage_scripts(7)
+
+        outputs = []
+        for args in [["--jobs", "1"], ["--jobs", "4"], ["--jobs", "4", "--prefilter"]]:
+            shutil.rmtree(conf.analysis_dir, ignore_errors=True)
+            buf = io.StringIO()
+            with redirect_stdout(buf):
+                self.exec(conf, "deps", "--stage", "clean", *args)
+            with open(self.file_path(".deba/deps/clean.d"), "r") as f:
+                outputs.append((f.read(), buf.getvalue()))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+        self.assertIn(
+            "$(DEBA_DATA_DIR)/clean/out_5.csv $(DEBA_DATA_DIR)/clean/out_2.csv &:",
+            outputs[1][0],
+        )
+        self.assertIn("WARNING: target", outputs[1][1])
+
+        self.write_file("clean/s3.py", ['df = read_csv("raw/in_3.csv")'])
+        os.remove(self.file_path("clean/s4.py"))
+        for jobs in ["1", "4"]:
+            shutil.rmtree(conf.analysis_dir, ignore_errors=True)
+            buf = io.StringIO()
+            with redirect_stdout(buf):
+                with self.assertRaises(ModuleParseError):
+                    self.exec(conf, "deps", "--stage", "clean", "--jobs", jobs)
+            self.assertIn(
+                "error analyzing script %s" % self.file_path("clean/s3.py"),
+                buf.getvalue(),
+            )
+
+    def test_parallel_analysis_summaries(self):
+        conf = Config(
+            stages=[Stage(name="clean")],
+            patterns=ExprPatterns(
+                prerequisites=[r'read_csv(".+\\.csv")'],
+                targets=[r'`*`.to_csv(".+\\.csv")'],
+            ),
+            root_dir=self._dir.name,
+        )
+        self.write_file("lib/__init__.py", [""])
+        self.write_file(
+            "lib/io.py",
+            ["def load():", '  return read_csv("raw/in.csv")', ""],
+        )
+        for i in range(4):
+            self.write_file(
+                "clean/s%d.py" % i,
+                [
+                    "from lib.io import load",
+                    'if __name__ == "__main__":',
+                    "  df = load()",
+                    '  df.to_csv("clean/out_%d.csv")' % i,
+                ],
+            )
+
+        summaries = []
+        for jobs in ["1", "4"]:
+            shutil.rmtree(conf.analysis_dir, ignore_errors=True)
+            with self.assertLogs("deba", logging.INFO) as logs:
+                self.exec(
+                    conf, "deps", "--stage", "clean", "--jobs", jobs, "--prefilter"
+                )
+            summaries.append(logs.output)
+        # workers memoize lookups on their own, so only the prefilter counters
+        # add up to the same numbers
+        self.assertEqual(len(summaries[1]), 2)
+        self.assertRegex(summaries[1][0], r"INFO:deba:\d+ module lookups")
+        self.assertEqual(
+            summaries[1][1],
+            "INFO:deba:prefilter skipped pattern tests in 0 of 8 bodies",
+        )
+        self.assertEqual(summaries[0][1], summaries[1][1])
+
+    def test_worker_logging(self):
+        conf = Config(stages=[Stage(name="clean")], root_dir=self._dir.name)
+        logger = logging.getLogger("deba")
+        handlers, level = logger.handlers, logger.level
+        err = io.StringIO()
+        try:
+            with redirect_stderr(err):
+                deps._init_worker(conf, (), None, False, logging.INFO)
+            deps._worker_state["script"] = "clean/a.py"
+            logger.warning("something odd")
+        finally:
+            deps._worker_state.clear()
+            logger.handlers, logger.level = handlers, level
+        self.assertRegex(
+            err.getvalue(),
+            r"^\S+ \S+ - deba - WARNING - clean/a.py - something odd\n$",
+        )
+
+    def test_local_modules(self):
+        conf = Config(
+            stages=[Stage(name="clean")],
+            patterns=ExprPatterns(
+                prerequisites=[r'read_csv(".+\\.csv")'],
+                targets=[r'`*`.to_csv(".+\\.csv")'],
+            ),
+            root_dir=self._dir.name,
+        )
+        self.write_file("lib/__init__.py", [""])
+        self.write_file(
+            "lib/io.py",
+            ["def load():", '  return read_csv("raw/a_input.csv")', ""],
+        )
+        self.write_file("lib/unused.py", ["def unused():", "  pass", ""])
+        self.write_file(
+            "clean/a.py",
+            [
+                "from lib.io import load",
+                "from lib.unused import unused",
+                'if __name__ == "__main__":',
+                "  df = load()",
+                '  df.to_csv("clean/a_output.csv")',
+            ],
+        )
+
+        self.exec(conf, "deps", "--stage", "clean", "--jobs", "1")
+
+        self.assertFileContent(
+            ".deba/deps/clean.d",
+            [
+                "DEBA_DEPS_SOURCES += lib/io.py lib/unused.py",
+                "",
+                "$(DEBA_DATA_DIR)/clean: ; @-mkdir -p $@ 2>/dev/null",
+                "",
+                "DEBA_MD5_SOURCES += clean/a.py lib/io.py",
+                "$(DEBA_DATA_DIR)/clean/a_output.csv &: $(DEBA_MD5_DIR)/clean/a.py.md5 $(DEBA_DATA_MD5_DIR)/raw/a_input.csv.md5 $(DEBA_MD5_DIR)/lib/io.py.md5 | $(DEBA_DATA_DIR)/clean",
+                "\t$(call deba_execute,clean/a.py)",
+                "",
+                "",
+            ],
+        )
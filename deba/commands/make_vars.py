@@ -0,0 +1,120 @@
+import argparse
+import hashlib
+import os
+import typing
+
+from deba.commands.decorators import subcommand
+from deba.config import Config, Stage
+from deba.file_utils import write_if_changed
+from deba.serialize import yaml_dump
+
+
+def escape(value: str) -> str:
+    return value.replace("$", "$$").replace("#", "\\#")
+
+
+def make_vars(conf: Config) -> typing.List[typing.Tuple[str, str]]:
+    return [
+        ("DEBA_DATA_DIR", conf.data_dir),
+        ("DEBA_MD5_DIR", conf.md5_dir),
+        ("DEBA_STAGES", " ".join(stage.name for stage in conf.stages)),
+        ("DEBA_PYTHON_PATH", os.pathsep.join(conf.script_search_paths)),
+        (
+            "DEBA_TARGETS",
+            " ".join(
+                os.path.join(conf.data_dir, target) for target in conf.targets or []
+            ),
+        ),
+    ]
+
+
+def _digest(obj) -> str:
+    return hashlib.sha1(yaml_dump(obj).encode("utf-8")).hexdigest()
+
+
+def _pattern_texts(conf: Config) -> typing.Union[typing.Dict, None]:
+    if conf.patterns is None:
+        return None
+    return {
+        name: [pat.text for pat in getattr(conf.patterns, name) or []]
+        for name in ["prerequisites", "references", "targets"]
+    }
+
+
+def stage_fingerprint(conf: Config, stage: Stage) -> str:
+    """Digests every setting that rules of stage are generated from."""
+    return _digest(
+        {
+            "stage": stage,
+            "patterns": _pattern_texts(conf),
+            "pythonPath": conf.script_search_paths,
+            "dataDir": conf.data_dir,
+            "opaque": conf.opaque,
+            # scripts whose targets are overridden are skipped
+            "overriddenTargets": sorted(
+                sorted(rule.target_set) for rule in conf.overrides or []
+            ),
+            "stageOrder": [st.name for st in conf.stages]
+            if conf.enforce_stage_order
+            else None,
+        }
+    )
+
+
+def main_fingerprint(conf: Config) -> str:
+    """Digests every setting that overridden rules are generated from."""
+    return _digest({"overrides": conf.overrides or []})
+
+
+def md5_fingerprint(conf: Config) -> str:
+    """Digests every setting that checksum files are computed from."""
+    return _digest({"semanticFingerprints": conf.semantic_fingerprints})
+
+
+def write_fingerprints(conf: Config):
+    """Writes fingerprints that make rules of each stage, main.d and checksums depend on.
+
+    Only fingerprints whose content changed are written so that editing the
+    settings of one stage doesn't make every stage stale.
+    """
+    stages_dir = os.path.join(conf.fingerprints_dir, "stages")
+    for stage in conf.stages:
+        write_if_changed(
+            os.path.join(stages_dir, stage.name), stage_fingerprint(conf, stage) + "\n"
+        )
+    write_if_changed(
+        os.path.join(conf.fingerprints_dir, "main"), main_fingerprint(conf) + "\n"
+    )
+    write_if_changed(
+        os.path.join(conf.fingerprints_dir, "md5"), md5_fingerprint(conf) + "\n"
+    )
+    names = set(stage.name for stage in conf.stages)
+    for name in os.listdir(stages_dir) if os.path.isdir(stages_dir) else []:
+        if name not in names:
+            os.remove(os.path.join(stages_dir, name))
+
+
+def exec(conf: Config, args: argparse.Namespace):
+    content = "".join(
+        "%s := %s\n" % (name, escape(value)) for name, value in make_vars(conf)
+    )
+    print(content, end="")
+
+    os.makedirs(conf.deba_dir, exist_ok=True)
+    tmp_filepath = conf.vars_filepath + ".tmp"
+    with open(tmp_filepath, "w") as f:
+        f.write(content)
+    os.replace(tmp_filepath, conf.vars_filepath)
+    write_fingerprints(conf)
+
+
+@subcommand(exec=exec)
+def add_subcommand(
+    subparsers: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser
+) -> argparse.ArgumentParser:
+    parser = subparsers.add_parser(
+        name="makeVars",
+        parents=[parent_parser],
+        help="print all DEBA_* make variables and write them to .deba/vars.mk, along with fingerprints of the settings of each stage",
+    )
+    return parser
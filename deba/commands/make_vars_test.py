@@ -0,0 +1,77 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from deba.commands.make_vars import add_subcommand
+from deba.config import Config, ExecutionRule, Stage
+from deba.test_utils import TempDirMixin
+from deba.test_utils import subcommand_testcase, CommandTestCaseMixin
+
+
+@subcommand_testcase(add_subcommand)
+class MakeVarsCommandTestCase(CommandTestCaseMixin, TempDirMixin, unittest.TestCase):
+    @patch("builtins.print")
+    def test_run(self, mock_print):
+        conf = Config(
+            stages=[Stage(name="clean"), Stage(name="fuse")],
+            targets=["fuse/personnel.csv", "fuse/complaint.csv"],
+            python_path=["src/lib"],
+            md5_dir="/runner/_work/$md5",
+            root_dir=self._dir.name,
+        )
+
+        self.exec(conf, "makeVars")
+
+        lines = [
+            "DEBA_DATA_DIR := data",
+            "DEBA_MD5_DIR := /runner/_work/$$md5",
+            "DEBA_STAGES := clean fuse",
+            "DEBA_PYTHON_PATH := %s" % os.pathsep.join([self._dir.name, "src/lib"]),
+            "DEBA_TARGETS := data/fuse/personnel.csv data/fuse/complaint.csv",
+            "",
+        ]
+        mock_print.assert_called_once_with("\n".join(lines), end="")
+        self.assertFileContent(".deba/vars.mk", lines)
+
+    @patch("builtins.print")
+    def test_fingerprints(self, mock_print):
+        def exec_make_vars(fuse: Stage, recipe: str):
+            self.exec(
+                Config(
+                    stages=[Stage(name="clean"), fuse],
+                    overrides=[ExecutionRule(target="clean/a.csv", recipe=recipe)],
+                    root_dir=self._dir.name,
+                ),
+                "makeVars",
+            )
+
+        filenames = [
+            ".deba/fingerprints/stages/clean",
+            ".deba/fingerprints/stages/fuse",
+            ".deba/fingerprints/main",
+        ]
+
+        def reset_mod_times():
+            for filename in filenames:
+                os.utime(self.file_path(filename), ns=(0, 0))
+
+        exec_make_vars(Stage(name="fuse"), "a")
+        reset_mod_times()
+        exec_make_vars(Stage(name="fuse"), "a")
+        self.assertEqual([self.mod_time(name) for name in filenames], [0, 0, 0])
+
+        exec_make_vars(Stage(name="fuse", ignored_targets=["fuse/b.csv"]), "a")
+        self.assertEqual(
+            [self.mod_time(name) > 0 for name in filenames], [False, True, False]
+        )
+
+        reset_mod_times()
+        exec_make_vars(Stage(name="fuse", ignored_targets=["fuse/b.csv"]), "b")
+        self.assertEqual(
+            [self.mod_time(name) > 0 for name in filenames], [False, False, True]
+        )
+
+        self.exec(
+            Config(stages=[Stage(name="clean")], root_dir=self._dir.name), "makeVars"
+        )
+        self.assertFileRemoved(".deba/fingerprints/stages/fuse")
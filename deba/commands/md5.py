@@ -0,0 +1,230 @@
+import argparse
+import ast
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import time
+import typing
+
+from attrs import define, field
+
+from deba.commands.decorators import subcommand
+from deba.config import Config
+from deba.file_utils import write_if_changed
+
+
+logger = logging.getLogger("deba")
+
+# files modified this recently are hashed again next time, a change within the
+# same mtime tick would otherwise go unnoticed
+RACY_WINDOW_NS = 2 * 10**9
+
+
+def file_md5(filepath: str) -> str:
+    h = hashlib.md5()
+    buf = bytearray(1 << 20)
+    view = memoryview(buf)
+    with open(filepath, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def strip_docstrings(tree: ast.AST) -> ast.AST:
+    for node in ast.walk(tree):
+        if not isinstance(
+            node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+        ):
+            continue
+        body = node.body
+        if (
+            body
+            and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)
+        ):
+            node.body = body[1:] or [ast.Pass()]
+    return tree
+
+
+def semantic_md5(filepath: str) -> str:
+    """Digests the syntax tree of a Python file, without docstrings.
+
+    Comments and formatting don't make it into the tree. Falls back to the
+    digest of the bytes if the file can't be parsed.
+    """
+    with open(filepath, "rb") as f:
+        content = f.read()
+    try:
+        tree = ast.parse(content, filepath)
+    except (SyntaxError, ValueError):
+        return hashlib.md5(content).hexdigest()
+    return hashlib.md5(ast.dump(strip_docstrings(tree)).encode("utf-8")).hexdigest()
+
+
+@define
+class StatCache(object):
+    """Remembers digests of files along with their size, mtime and inode."""
+
+    filepath: str
+    # filename -> [size, mtime_ns, inode, digest, kind of digest]
+    entries: typing.Dict[str, typing.List] = field(factory=dict)
+    dirty: bool = False
+
+    @classmethod
+    def load(cls, filepath: str) -> "StatCache":
+        try:
+            with open(filepath, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = dict()
+        return cls(filepath, entries if type(entries) is dict else dict())
+
+    def get(
+        self, filename: str, st: os.stat_result, kind: str
+    ) -> typing.Union[str, None]:
+        entry = self.entries.get(filename)
+        if entry is None or entry[:3] != [st.st_size, st.st_mtime_ns, st.st_ino]:
+            return None
+        if entry[4:] != [kind]:
+            return None
+        return entry[3]
+
+    def put(
+        self, filename: str, st: os.stat_result, digest: str, kind: str, now_ns: int
+    ):
+        if now_ns - st.st_mtime_ns < RACY_WINDOW_NS:
+            self.entries.pop(filename, None)
+        else:
+            self.entries[filename] = [
+                st.st_size,
+                st.st_mtime_ns,
+                st.st_ino,
+                digest,
+                kind,
+            ]
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        tmp_filepath = "%s.%d.tmp" % (self.filepath, os.getpid())
+        with open(tmp_filepath, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_filepath, self.filepath)
+
+
+def md5_filepath(conf: Config, filename: str) -> str:
+    return os.path.join(conf._root_dir, conf.md5_dir, "%s.md5" % filename)
+
+
+def data_md5_filepath(conf: Config, filename: str) -> str:
+    return os.path.join(conf.data_md5_dir, "%s.md5" % filename)
+
+
+def refresh_checksums(
+    conf: Config, filenames: typing.List[str], jobs: int = 1, data: bool = False
+) -> typing.List[str]:
+    """Writes checksum files of filenames, relative to the root directory.
+
+    If data is true, filenames are relative to the data directory instead and
+    their checksums are written into the data checksum directory. Files whose
+    size, mtime and inode didn't change since they were last hashed are not
+    hashed again. Python files are digested with semantic_md5 if semantic
+    fingerprints are configured. Checksum files are in md5sum format and are
+    only written if their content changes. Returns paths relative to the root
+    directory of files whose checksum files were written.
+    """
+    cache = StatCache.load(conf.md5_cache_filepath)
+    filenames = list(dict.fromkeys(filenames))
+    paths = {
+        filename: os.path.join(conf.data_dir, filename) if data else filename
+        for filename in filenames
+    }
+    stats = {
+        filename: os.stat(os.path.join(conf._root_dir, paths[filename]))
+        for filename in filenames
+    }
+    kinds = {
+        filename: "ast"
+        if conf.semantic_fingerprints and not data and filename.endswith(".py")
+        else "bytes"
+        for filename in filenames
+    }
+    digests = dict()
+    for filename in filenames:
+        digest = cache.get(paths[filename], stats[filename], kinds[filename])
+        if digest is not None:
+            digests[filename] = digest
+    stale = [filename for filename in filenames if filename not in digests]
+    logger.info(
+        "hashing %d of %d files, %d unchanged since last hashed",
+        len(stale),
+        len(filenames),
+        len(filenames) - len(stale),
+    )
+
+    def digest(filename: str) -> str:
+        filepath = os.path.join(conf._root_dir, paths[filename])
+        if kinds[filename] == "ast":
+            return semantic_md5(filepath)
+        return file_md5(filepath)
+
+    now_ns = time.time_ns()
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(stale) or 1))) as ex:
+        for filename, value in zip(stale, ex.map(digest, stale)):
+            digests[filename] = value
+            cache.put(paths[filename], stats[filename], value, kinds[filename], now_ns)
+    cache.save()
+
+    written = []
+    for filename in filenames:
+        checksum_filepath = (
+            data_md5_filepath(conf, filename) if data else md5_filepath(conf, filename)
+        )
+        if write_if_changed(
+            checksum_filepath, "%s  %s\n" % (digests[filename], paths[filename])
+        ):
+            written.append(paths[filename])
+    return written
+
+
+def exec(conf: Config, args: argparse.Namespace):
+    for filename in refresh_checksums(conf, args.files, args.jobs, args.data):
+        print("  updated checksum of %s" % filename)
+
+
+@subcommand(exec=exec)
+def add_subcommand(
+    subparsers: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser
+) -> argparse.ArgumentParser:
+    parser = subparsers.add_parser(
+        name="md5",
+        parents=[parent_parser],
+        description="write md5 checksums of files into md5Dir, only rewriting checksums that changed",
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        metavar="FILE",
+        help="files relative to the root directory, or to dataDir with --data",
+    )
+    parser.add_argument(
+        "--data",
+        action="store_true",
+        help="hash data files and write their checksums into .deba/data_md5 instead",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of threads used to hash files, defaults to the number of CPUs",
+    )
+    return parser
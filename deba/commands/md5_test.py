@@ -0,0 +1,166 @@
+import hashlib
+import os
+import unittest
+from unittest.mock import patch
+
+from deba.commands import md5
+from deba.commands.md5 import add_subcommand
+from deba.config import Config, Stage
+from deba.test_utils import TempDirMixin
+from deba.test_utils import subcommand_testcase, CommandTestCaseMixin
+
+
+@subcommand_testcase(add_subcommand)
+class MD5CommandTestCase(CommandTestCaseMixin, TempDirMixin, unittest.TestCase):
+    def digest(self, filename: str) -> str:
+        with open(self.file_path(filename), "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def age(self, *filenames: str):
+        """Moves mtimes of files out of the window in which they are hashed again."""
+        for filename in filenames:
+            st = os.stat(self.file_path(filename))
+            os.utime(self.file_path(filename), ns=(st.st_atime_ns, 10**18))
+
+    @patch("builtins.print")
+    def test_run(self, mock_print):
+        conf = Config(stages=[Stage(name="clean")], root_dir=self._dir.name)
+        self.write_file("clean/a.py", ["print('a')", ""])
+        self.write_file("ref.json", ["{}" * (1 << 20)])
+        self.age("clean/a.py", "ref.json")
+
+        with patch("deba.commands.md5.file_md5", wraps=md5.file_md5) as mock_md5:
+            self.exec(conf, "md5", "clean/a.py", "ref.json", "clean/a.py")
+            self.assertEqual(mock_md5.call_count, 2)
+            mtime = self.assertFileContent(
+                ".deba/md5/clean/a.py.md5",
+                ["%s  clean/a.py" % self.digest("clean/a.py"), ""],
+            )
+            self.assertFileContent(
+                ".deba/md5/ref.json.md5",
+                ["%s  ref.json" % self.digest("ref.json"), ""],
+            )
+            mock_print.assert_any_call("  updated checksum of ref.json")
+
+            # unchanged stats, nothing is hashed nor written
+            mock_md5.reset_mock()
+            mock_print.reset_mock()
+            self.exec(conf, "md5", "clean/a.py", "ref.json")
+            mock_md5.assert_not_called()
+            mock_print.assert_not_called()
+            self.assertFileNotModifiedSince(".deba/md5/clean/a.py.md5", mtime)
+
+            # same content, checksum file is kept
+            os.utime(self.file_path("clean/a.py"), ns=(0, 0))
+            self.exec(conf, "md5", "clean/a.py")
+            mock_md5.assert_called_once_with(self.file_path("clean/a.py"))
+            self.assertFileNotModifiedSince(".deba/md5/clean/a.py.md5", mtime)
+
+            self.write_file("clean/a.py", ["print('b')", ""])
+            self.exec(conf, "md5", "clean/a.py")
+            self.assertFileContent(
+                ".deba/md5/clean/a.py.md5",
+                ["%s  clean/a.py" % self.digest("clean/a.py"), ""],
+            )
+            mock_print.assert_called_once_with("  updated checksum of clean/a.py")
+
+            # recently modified files are always hashed again
+            mock_md5.reset_mock()
+            self.exec(conf, "md5", "clean/a.py")
+            mock_md5.assert_called_once_with(self.file_path("clean/a.py"))
+
+    @patch("builtins.print")
+    def test_semantic_fingerprints(self, mock_print):
+        conf = Config(
+            stages=[Stage(name="clean")],
+            semantic_fingerprints=True,
+            root_dir=self._dir.name,
+        )
+        self.write_file(
+            "clean/a.py",
+            [
+                "def f(x):",
+                "    return x + 1",
+                "",
+                "if __name__ == '__main__':",
+                "    f(1)",
+                "",
+            ],
+        )
+        self.write_file("clean/notes.txt", ["a"])
+        self.exec(conf, "md5", "clean/a.py", "clean/notes.txt")
+        mtime = self.mod_time(".deba/md5/clean/a.py.md5")
+        self.assertFileContent(
+            ".deba/md5/clean/notes.txt.md5",
+            ["%s  clean/notes.txt" % self.digest("clean/notes.txt"), ""],
+        )
+
+        self.write_file(
+            "clean/a.py",
+            [
+                '"""Adds one."""',
+                "",
+                "",
+                "def f(x):  # increments",
+                '    """Returns x plus one."""',
+                "    return (x +",
+                "            1)",
+                "",
+                'if __name__ == "__main__":',
+                "    f(1)",
+                "",
+            ],
+        )
+        self.exec(conf, "md5", "clean/a.py")
+        self.assertFileNotModifiedSince(".deba/md5/clean/a.py.md5", mtime)
+
+        self.write_file(
+            "clean/a.py",
+            [
+                "def f(x):",
+                "    return x + 2",
+                "",
+                "if __name__ == '__main__':",
+                "    f(1)",
+                "",
+            ],
+        )
+        self.exec(conf, "md5", "clean/a.py")
+        mock_print.assert_called_with("  updated checksum of clean/a.py")
+
+        # switching back to digests of bytes rewrites the checksum
+        conf.semantic_fingerprints = False
+        mock_print.reset_mock()
+        self.exec(conf, "md5", "clean/a.py")
+        self.assertFileContent(
+            ".deba/md5/clean/a.py.md5",
+            ["%s  clean/a.py" % self.digest("clean/a.py"), ""],
+        )
+
+    @patch("builtins.print")
+    def test_data(self, mock_print):
+        conf = Config(
+            stages=[Stage(name="clean")],
+            semantic_fingerprints=True,
+            root_dir=self._dir.name,
+        )
+        self.write_file("data/clean/a.csv", ["a,b", "1,2", ""])
+        self.exec(conf, "md5", "--data", "clean/a.csv")
+        mtime = self.assertFileContent(
+            ".deba/data_md5/clean/a.csv.md5",
+            ["%s  data/clean/a.csv" % self.digest("data/clean/a.csv"), ""],
+        )
+        mock_print.assert_called_once_with("  updated checksum of data/clean/a.csv")
+
+        # rewriting the same data keeps the checksum
+        self.write_file("data/clean/a.csv", ["a,b", "1,2", ""])
+        self.exec(conf, "md5", "--data", "clean/a.csv")
+        self.assertFileNotModifiedSince(".deba/data_md5/clean/a.csv.md5", mtime)
+
+        self.write_file("data/clean/a.csv", ["a,b", "1,3", ""])
+        self.exec(conf, "md5", "--data", "clean/a.csv")
+        self.assertFileContent(
+            ".deba/data_md5/clean/a.csv.md5",
+            ["%s  data/clean/a.csv" % self.digest("data/clean/a.csv"), ""],
+        )
+        self.assertFalse(os.path.exists(self.file_path(".deba/md5/clean/a.csv.md5")))
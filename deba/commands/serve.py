@@ -0,0 +1,148 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import traceback
+import typing
+
+from deba.client import SOCKET_PATH
+from deba.commands.decorators import subcommand
+from deba.config import Config, clear_config_cache, get_config
+from deba.deps.module import new_loader
+
+
+logger = logging.getLogger("deba")
+
+# commands that must run in the client process
+LOCAL_COMMANDS = ["init", "serve"]
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        req = json.loads(line.decode("utf-8"))
+        resp = self.server.dispatch(req["argv"])
+        self.wfile.write(json.dumps(resp).encode("utf-8") + b"\n")
+
+
+class Server(socketserver.UnixStreamServer):
+    """Answers deba commands while keeping the config and Loader warm.
+
+    Requests are handled one at a time, therefore commands never share the
+    Loader concurrently.
+    """
+
+    def __init__(self, conf: Config, socket_path: str = SOCKET_PATH):
+        self.conf = conf
+        self.loader = new_loader(conf)
+        self.socket_path = socket_path
+        self._conf_stat = self._stat_config()
+        super().__init__(socket_path, RequestHandler)
+
+    @property
+    def _config_path(self) -> str:
+        return os.path.join(self.conf._root_dir, "deba.yaml")
+
+    def _stat_config(self) -> typing.Union[typing.Tuple[int, int], None]:
+        try:
+            st = os.stat(self._config_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def refresh(self):
+        stat = self._stat_config()
+        if stat is not None and stat != self._conf_stat:
+            logger.info("deba.yaml changed, reloading config")
+            clear_config_cache()
+            self.conf = get_config(self.conf.root_dir)
+            self.loader = new_loader(self.conf)
+            self._conf_stat = stat
+        elif self.loader.refresh():
+            logger.info("source files changed, dropped stale modules")
+
+    def dispatch(self, argv: typing.List[str]) -> typing.Dict:
+        from deba.commands import dispatched_command, get_parser
+
+        if dispatched_command(argv) in LOCAL_COMMANDS:
+            return {"fallback": True}
+        out, err = io.StringIO(), io.StringIO()
+        handler = logging.StreamHandler(err)
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+        level = logger.level
+        logger.addHandler(handler)
+        status = 0
+        try:
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                try:
+                    self.refresh()
+                    args = get_parser(argv).parse_args(argv)
+                    logger.setLevel(logging.INFO if args.verbose else logging.WARN)
+                    args.loader = self.loader
+                    args.exec(self.conf, args)
+                except SystemExit as e:
+                    status = e.code if type(e.code) is int else 1
+                except Exception:
+                    traceback.print_exc()
+                    status = 1
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+        return {"status": status, "stdout": out.getvalue(), "stderr": err.getvalue()}
+
+
+def remove_stale_socket(socket_path: str):
+    if not os.path.exists(socket_path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+    else:
+        raise ValueError("a deba server is already listening on %s" % socket_path)
+    finally:
+        sock.close()
+
+
+def exec(conf: Config, args: argparse.Namespace):
+    os.makedirs(os.path.dirname(args.socket) or ".", exist_ok=True)
+    remove_stale_socket(args.socket)
+    server = Server(conf, args.socket)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print("listening on %s" % args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+@subcommand(exec=exec)
+def add_subcommand(
+    subparsers: argparse._SubParsersAction, parent_parser: argparse.ArgumentParser
+) -> argparse.ArgumentParser:
+    parser = subparsers.add_parser(
+        name="serve",
+        parents=[parent_parser],
+        help="keep analysis warm and answer commands sent by `python -m deba.client`",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=SOCKET_PATH,
+        help="path of the unix socket to listen on",
+    )
+    return parser
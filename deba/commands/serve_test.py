@@ -0,0 +1,82 @@
+import os
+import threading
+import unittest
+
+from deba.client import request
+from deba.commands.serve import Server
+from deba.config import Config, Stage
+from deba.deps.expr import ExprPatterns
+from deba.test_utils import TempDirMixin
+
+
+class ServerTestCase(TempDirMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.socket_path = self.file_path("deba.sock")
+        self.conf = Config(
+            stages=[Stage(name="clean")],
+            patterns=ExprPatterns(
+                prerequisites=[r'read_csv(".+\\.csv")'],
+                targets=[r'`*`.to_csv(".+\\.csv")'],
+            ),
+            root_dir=self._dir.name,
+        )
+
+    def start_server(self) -> Server:
+        server = Server(self.conf, self.socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return server
+
+    def test_no_server(self):
+        self.assertIsNone(request(["stages"], self.socket_path))
+
+    def test_request(self):
+        server = self.start_server()
+
+        self.assertEqual(
+            request(["stages"], self.socket_path),
+            {"status": 0, "stdout": "clean\n", "stderr": ""},
+        )
+        self.assertIsNone(request(["init"], self.socket_path))
+
+        resp = request(["deps", "--stage", "unknown"], self.socket_path)
+        self.assertEqual(resp["status"], 1)
+        self.assertIn("ValueError", resp["stderr"])
+
+        self.write_file("helper.py", ["name = 'raw/a.csv'", ""])
+        self.write_file(
+            "clean/a.py",
+            [
+                "from helper import name",
+                "",
+                'if __name__ == "__main__":',
+                "  df = read_csv(name)",
+                '  df.to_csv("clean/a.csv")',
+            ],
+        )
+        resp = request(["deps", "--stage", "clean"], self.socket_path)
+        self.assertEqual(resp["status"], 0, resp["stderr"])
+        self.assertIn(self.file_path("helper.py"), server.loader.module_asts)
+        rule = (
+            "$(DEBA_DATA_DIR)/clean/a.csv &: $(DEBA_MD5_DIR)/clean/a.py.md5 "
+            "$(DEBA_DATA_MD5_DIR)/raw/%s.csv.md5 $(DEBA_MD5_DIR)/helper.py.md5 "
+            "| $(DEBA_DATA_DIR)/clean"
+        )
+        with open(self.file_path(".deba/deps/clean.d")) as f:
+            self.assertIn(rule % "a", f.read())
+
+        # edited helper must be parsed again
+        self.write_file("helper.py", ["name = 'raw/b_input.csv'", ""])
+        os.utime(self.file_path("helper.py"), ns=(0, 0))
+        resp = request(["deps", "--stage", "clean"], self.socket_path)
+        self.assertEqual(resp["status"], 0, resp["stderr"])
+        with open(self.file_path(".deba/deps/clean.d")) as f:
+            self.assertIn(rule % "b_input", f.read())
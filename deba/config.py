@@ -1,13 +1,16 @@
+import hashlib
 import os
+import pickle
+import sys
+import types
 import typing
 import pathlib
 from fnmatch import fnmatchcase
 
-from attrs import define, validators
+from attrs import define, field, fields, validators
 
 from deba.attrs_utils import field_transformer, doc
-from deba.serialize import yaml_dump, yaml_load
-from deba.deps.expr import ExprPatterns
+from deba.deps.expr import ExprPattern, ExprPatterns
 
 
 @define(field_transformer=field_transformer(globals()), slots=False)
@@ -33,6 +36,10 @@ class Stage(object):
     def deps_filepath(self) -> str:
         return os.path.join(self._conf.deps_dir, "%s.d" % self.name)
 
+    @property
+    def analysis_filepath(self) -> str:
+        return os.path.join(self._conf.analysis_dir, "%s.json" % self.name)
+
     @property
     def script_dir(self) -> str:
         return os.path.join(self._conf._root_dir, self.name)
@@ -85,6 +92,27 @@ class ExecutionRule(object):
         return " ".join("$(DEBA_DATA_DIR)/%s" % s for s in self.target)
 
 
+@define(field_transformer=field_transformer(globals()))
+class Opaque(object):
+    """Modules that are never parsed during code analysis.
+
+    Importing an opaque module binds its name to a stub without any children
+    instead of parsing the module. Modules are transparent by default.
+    """
+
+    modules: typing.List[str] = doc(
+        "module names, which could be Unix shell-style wildcards as supported by fnmatch. A matching module makes every module under it opaque as well."
+    )
+    paths: typing.List[str] = doc(
+        "files or directories, relative to the root directory, whose modules are opaque"
+    )
+
+    def abs_paths(self, root_dir: str) -> typing.List[str]:
+        if self.paths is None:
+            return []
+        return [os.path.normpath(os.path.join(root_dir, p)) for p in self.paths]
+
+
 @define(field_transformer=field_transformer(globals()))
 class Config(object):
     """Dirk configurations."""
@@ -112,10 +140,19 @@ class Config(object):
         "additional search paths for module files. The directory that contains deba.yaml file will be prepended to this list. This list is then concatenated as PYTHONPATH env var during script execution."
     )
 
+    opaque: Opaque = doc(
+        "modules that are not analyzed, such as vendored libraries or generated code that never read nor write data"
+    )
+
     enforce_stage_order: bool = doc(
         "make sure that scripts cannot read outputs of later stages.", default=False
     )
 
+    semantic_fingerprints: bool = doc(
+        "fingerprint Python files by their syntax tree instead of their bytes, so that editing comments, docstrings or formatting doesn't rerun scripts. Fingerprints may change once when upgrading Python.",
+        default=False,
+    )
+
     data_dir: str = doc(
         "keep all generated data in this folder",
         default="data",
@@ -130,6 +167,15 @@ class Config(object):
         required=True,
     )
 
+    # read-only indexes built once after load, see build_indexes. They are not
+    # pickled but built again after unpickling
+    # frozenset of targets -> index of the first override with those targets
+    _override_index: types.MappingProxyType = field(init=False, repr=False, eq=False)
+    # stage name -> index of the stage
+    _stage_ordinals: types.MappingProxyType = field(init=False, repr=False, eq=False)
+    # stage name -> stage
+    _stage_index: types.MappingProxyType = field(init=False, repr=False, eq=False)
+
     @property
     def script_search_paths(self) -> typing.List[str]:
         if self.python_path is None:
@@ -139,23 +185,56 @@ class Config(object):
     def __attrs_post_init__(self):
         for stage in self.stages:
             stage._conf = self
+        self.build_indexes()
+
+    def __getstate__(self):
+        return tuple(getattr(self, a.name) for a in fields(type(self)) if a.init)
+
+    def __setstate__(self, state):
+        for a, value in zip([a for a in fields(type(self)) if a.init], state):
+            object.__setattr__(self, a.name, value)
+        self.build_indexes()
+
+    def build_indexes(self):
+        """Indexes overrides by their targets and stages by their names.
+
+        Earlier overrides and stages take precedence over later ones with the
+        same targets or name. Call this again after changing overrides or
+        stages.
+        """
+        override_index = dict()
+        for idx, rule in enumerate(self.overrides or []):
+            override_index.setdefault(frozenset(rule.target_set), idx)
+        stage_ordinals, stage_index = dict(), dict()
+        for idx, stage in enumerate(self.stages):
+            stage_ordinals.setdefault(stage.name, idx)
+            stage_index.setdefault(stage.name, stage)
+        self._override_index = types.MappingProxyType(override_index)
+        self._stage_ordinals = types.MappingProxyType(stage_ordinals)
+        self._stage_index = types.MappingProxyType(stage_index)
 
     def get_stage(self, name: str) -> typing.Union[Stage, None]:
-        for stage in self.stages:
-            if stage.name == name:
-                return stage
+        return self._stage_index.get(name)
+
+    def get_override(
+        self, targets: typing.Iterable[str]
+    ) -> typing.Union[typing.Tuple[int, ExecutionRule], None]:
+        """Returns the index and the override whose targets are exactly targets."""
+        idx = self._override_index.get(frozenset(targets))
+        if idx is None:
+            return None
+        return idx, self.overrides[idx]
 
     def is_data_from_latter_stages(self, stage_name: str, file_name: str) -> bool:
-        check = False
-        file_stage = file_name.split("/")[0]
-        for stage in self.stages:
-            if stage.name == stage_name:
-                check = True
-            elif check and stage.name == file_stage:
-                return True
-        return False
+        stage_ordinal = self._stage_ordinals.get(stage_name)
+        if stage_ordinal is None:
+            return False
+        file_ordinal = self._stage_ordinals.get(file_name.split("/")[0])
+        return file_ordinal is not None and file_ordinal > stage_ordinal
 
     def save(self):
+        from deba.serialize import yaml_dump
+
         with open(os.path.join(self._root_dir, "deba.yaml"), "w") as f:
             f.write(yaml_dump(self))
 
@@ -177,10 +256,99 @@ class Config(object):
     def main_deps_filepath(self) -> str:
         return os.path.join(self.deba_dir, "main.d")
 
+    @property
+    def analysis_dir(self) -> str:
+        return os.path.join(self.deba_dir, "analysis")
+
+    @property
+    def cache_dir(self) -> str:
+        return os.path.join(self.deba_dir, "cache")
+
+    @property
+    def md5_cache_filepath(self) -> str:
+        return os.path.join(self.deba_dir, "md5_stats.json")
+
+    @property
+    def data_md5_dir(self) -> str:
+        return os.path.join(self.deba_dir, "data_md5")
+
+    @property
+    def fingerprints_dir(self) -> str:
+        return os.path.join(self.deba_dir, "fingerprints")
+
+    @property
+    def vars_filepath(self) -> str:
+        return os.path.join(self.deba_dir, "vars.mk")
+
 
 _conf = None
 
 
+# classes whose instances make up a snapshot
+SNAPSHOT_CLASSES = (Config, Stage, ExecutionRule, Opaque, ExprPatterns, ExprPattern)
+
+
+def snapshot_schema() -> str:
+    """Digests names, types and init flags of fields of every class a snapshot holds.
+
+    Pickled attrs instances restore their fields by position, and Config and
+    ExprPattern only pickle init fields, so snapshots saved with differently
+    shaped classes must not be loaded.
+    """
+    return hashlib.sha1(
+        repr(
+            [
+                (
+                    cls.__qualname__,
+                    [(a.name, str(a.type), a.init) for a in fields(cls)],
+                )
+                for cls in SNAPSHOT_CLASSES
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+
+
+SNAPSHOT_SCHEMA = snapshot_schema()
+
+
+def snapshot_key(content: bytes) -> bytes:
+    digest = hashlib.sha1(content).hexdigest()
+    key = "%s-%s-%s" % (SNAPSHOT_SCHEMA, sys.implementation.cache_tag, digest)
+    return key.encode("ascii")
+
+
+def load_snapshot(filepath: str, key: bytes) -> typing.Union[Config, None]:
+    """Loads a Config pickled by save_snapshot if it was saved under the same key.
+
+    Unpickling bypasses attrs validators, the snapshot was validated when saved.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            if f.readline().rstrip(b"\n") != key:
+                return None
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def save_snapshot(filepath: str, key: bytes, conf: Config):
+    tmp_filepath = "%s.%d.tmp" % (filepath, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        with open(tmp_filepath, "wb") as f:
+            f.write(key + b"\n")
+            pickle.dump(conf, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filepath, filepath)
+    except OSError:
+        pass
+
+
+def clear_config_cache():
+    """Makes the next get_config call read deba.yaml again."""
+    global _conf
+    _conf = None
+
+
 def get_config(root: typing.Union[str, None] = None) -> Config:
     global _conf
     if _conf is not None:
@@ -189,12 +357,21 @@ def get_config(root: typing.Union[str, None] = None) -> Config:
         deba_path = "deba.yaml"
         if root is not None:
             deba_path = os.path.join(root, deba_path)
-        with open(deba_path, "r") as f:
-            _conf = yaml_load(f.read(), Config)
-        if root is not None:
-            _conf.root_dir = root
-        return _conf
+        with open(deba_path, "rb") as f:
+            content = f.read()
     except FileNotFoundError:
         raise FileNotFoundError(
             "deba config file not found: %s" % (pathlib.Path().cwd() / "deba.yaml")
         )
+    snapshot_path = os.path.join(os.path.dirname(deba_path), ".deba", "config.pickle")
+    key = snapshot_key(content)
+    conf = load_snapshot(snapshot_path, key)
+    if conf is None:
+        from deba.serialize import yaml_load
+
+        conf = yaml_load(content.decode("utf-8"), Config)
+        save_snapshot(snapshot_path, key, conf)
+    if root is not None:
+        conf.root_dir = root
+    _conf = conf
+    return _conf
@@ -0,0 +1,136 @@
+import os
+import pickle
+import unittest
+from unittest.mock import patch
+
+from deba import serialize
+from deba.config import (
+    Config,
+    ExecutionRule,
+    Stage,
+    Opaque,
+    clear_config_cache,
+    get_config,
+    snapshot_schema,
+    SNAPSHOT_SCHEMA,
+)
+from deba.test_utils import TempDirMixin
+
+
+class GetConfigTestCase(TempDirMixin, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        clear_config_cache()
+        self.addCleanup(clear_config_cache)
+
+    def load(self):
+        clear_config_cache()
+        with patch(
+            "deba.serialize.yaml_load", wraps=serialize.yaml_load
+        ) as mock_yaml_load:
+            conf = get_config(self._dir.name)
+        return conf, mock_yaml_load.called
+
+    def test_snapshot(self):
+        self.write_file(
+            "deba.yaml",
+            [
+                "stages:",
+                "  - name: clean",
+                "    ignoredScripts:",
+                "      - a.py",
+                "patterns:",
+                "  prerequisites:",
+                "    - read_csv(r'.+\\.csv')",
+                "",
+            ],
+        )
+
+        conf, parsed = self.load()
+        self.assertTrue(parsed)
+        self.assertTrue(os.path.isfile(self.file_path(".deba/config.pickle")))
+
+        conf, parsed = self.load()
+        self.assertFalse(parsed)
+        self.assertEqual(conf.root_dir, self._dir.name)
+        self.assertEqual(conf.stages[0].name, "clean")
+        self.assertEqual(conf.stages[0].ignored_scripts, ["a.py"])
+        self.assertIs(conf.stages[0]._conf, conf)
+        self.assertEqual(
+            [pat.text for pat in conf.patterns.prerequisites],
+            ["read_csv(r'.+\\.csv')"],
+        )
+        self.assertIsNotNone(conf.patterns.prerequisites[0].file_pat.match("a.csv"))
+
+        self.write_file("deba.yaml", ["stages:", "  - name: fuse", ""])
+        conf, parsed = self.load()
+        self.assertTrue(parsed)
+        self.assertEqual(conf.stages[0].name, "fuse")
+
+    def test_indexes(self):
+        self.write_file(
+            "deba.yaml",
+            [
+                "stages:",
+                "  - name: clean",
+                "  - name: match",
+                "  - name: fuse",
+                "overrides:",
+                "  - target: [clean/a.csv, clean/b.csv]",
+                "    recipe: first",
+                "  - target: clean/c.csv",
+                "    recipe: second",
+                "  - target: [clean/b.csv, clean/a.csv]",
+                "    recipe: shadowed",
+                "",
+            ],
+        )
+        self.load()
+        # indexes survive the snapshot
+        conf, parsed = self.load()
+        self.assertFalse(parsed)
+        self.assertIs(conf.get_stage("match"), conf.stages[1])
+        self.assertIsNone(conf.get_stage("other"))
+        self.assertEqual(conf.get_override(["clean/b.csv", "clean/a.csv"])[0], 0)
+        self.assertEqual(conf.get_override(["clean/c.csv"])[1].recipe, "second")
+        self.assertIsNone(conf.get_override(["clean/a.csv"]))
+        self.assertTrue(conf.is_data_from_latter_stages("clean", "fuse/a.csv"))
+        self.assertFalse(conf.is_data_from_latter_stages("fuse", "clean/a.csv"))
+        self.assertFalse(conf.is_data_from_latter_stages("match", "match/a.csv"))
+        self.assertFalse(conf.is_data_from_latter_stages("match", "raw/a.csv"))
+        self.assertFalse(conf.is_data_from_latter_stages("other", "fuse/a.csv"))
+        with self.assertRaises(TypeError):
+            conf._stage_index["other"] = conf.stages[0]
+        self.assertNotIn(b"mappingproxy", pickle.dumps(conf))
+
+        conf = Config(stages=[Stage(name="clean")])
+        self.assertIsNone(conf.get_override(["clean/a.csv"]))
+        conf.stages.append(Stage(name="fuse"))
+        conf.overrides = [ExecutionRule(target="clean/a.csv", recipe="cmd")]
+        conf.build_indexes()
+        self.assertIs(conf.get_stage("fuse"), conf.stages[1])
+        self.assertEqual(conf.get_override(["clean/a.csv"])[0], 0)
+
+    def test_corrupted_snapshot(self):
+        self.write_file("deba.yaml", ["stages:", "  - name: clean", ""])
+        self.load()
+        with open(self.file_path(".deba/config.pickle"), "r+b") as f:
+            f.seek(-10, os.SEEK_END)
+            f.truncate()
+
+        conf, parsed = self.load()
+        self.assertTrue(parsed)
+        self.assertEqual(conf.stages[0].name, "clean")
+
+    def test_snapshot_schema(self):
+        self.write_file("deba.yaml", ["stages:", "  - name: clean", ""])
+        self.load()
+        self.assertFalse(self.load()[1])
+
+        # snapshots of differently shaped classes are discarded
+        with patch("deba.config.SNAPSHOT_CLASSES", (Config, Stage, Opaque)):
+            self.assertNotEqual(snapshot_schema(), SNAPSHOT_SCHEMA)
+        with patch("deba.config.SNAPSHOT_SCHEMA", "0"):
+            self.assertTrue(self.load()[1])
+        self.assertTrue(self.load()[1])
+        self.assertFalse(self.load()[1])
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import typing
+
+from attrs import define, field
+
+from deba.deps.expr import ExprPattern, PatternIndex
+from deba.deps.find import FunctionSummaries, find_dependencies
+from deba.deps.module import Loader, listdir_names
+from deba.deps.prefilter import Prefilter
+
+
+def file_digest(filepath: str) -> str:
+    h = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@define
+class FileState(object):
+    mtime_ns: int
+    size: int
+    digest: str
+
+    @classmethod
+    def from_file(cls, filepath: str) -> "FileState":
+        st = os.stat(filepath)
+        return cls(st.st_mtime_ns, st.st_size, file_digest(filepath))
+
+    def is_current(self, filepath: str) -> bool:
+        """Tells whether the file still has the same content.
+
+        The file is only hashed if its size or modification time changed.
+        """
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return False
+        if st.st_size != self.size:
+            return False
+        if st.st_mtime_ns == self.mtime_ns:
+            return True
+        if file_digest(filepath) != self.digest:
+            return False
+        self.mtime_ns = st.st_mtime_ns
+        return True
+
+
+@define
+class DirState(object):
+    mtime_ns: int
+    # names of modules looked up in the directory -> whether it had an entry
+    # with that name
+    names: typing.Dict[str, bool] = field(factory=dict)
+
+    @classmethod
+    def from_dir(cls, dirpath: str) -> "DirState":
+        try:
+            return cls(os.stat(dirpath).st_mtime_ns)
+        except OSError:
+            return cls(-1)
+
+    def is_current(self, dirpath: str) -> bool:
+        """Tells whether lookups of the names would still find the same entries.
+
+        The directory is only listed if its modification time changed.
+        """
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            mtime_ns = -1
+        if mtime_ns == self.mtime_ns:
+            return True
+        entries = listdir_names(dirpath)
+        if any((name in entries) != found for name, found in self.names.items()):
+            return False
+        self.mtime_ns = mtime_ns
+        return True
+
+
+@define
+class ScriptAnalysis(object):
+    prerequisites: typing.List[str]
+    references: typing.List[str]
+    targets: typing.List[str]
+    # origin -> state of every local module the analysis touched
+    inputs: typing.Dict[str, FileState] = field(factory=dict)
+    # origins of other modules that define whatever the main block refers to,
+    # directly or through called functions, and of modules they import
+    modules: typing.List[str] = field(factory=list)
+    # directory -> state of the names of modules that were searched for in it,
+    # including those that weren't found there
+    dirs: typing.Dict[str, DirState] = field(factory=dict)
+
+    def is_current(self) -> bool:
+        return all(
+            state.is_current(origin) for origin, state in self.inputs.items()
+        ) and all(state.is_current(dirpath) for dirpath, state in self.dirs.items())
+
+    def as_dict(self) -> typing.Dict:
+        return {
+            "prerequisites": self.prerequisites,
+            "references": self.references,
+            "targets": self.targets,
+            "inputs": {
+                origin: [state.mtime_ns, state.size, state.digest]
+                for origin, state in self.inputs.items()
+            },
+            "modules": self.modules,
+            "dirs": {
+                dirpath: [state.mtime_ns, state.names]
+                for dirpath, state in self.dirs.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, d: typing.Dict) -> "ScriptAnalysis":
+        return cls(
+            d["prerequisites"],
+            d["references"],
+            d["targets"],
+            {origin: FileState(*state) for origin, state in d["inputs"].items()},
+            d["modules"],
+            {dirpath: DirState(*state) for dirpath, state in d["dirs"].items()},
+        )
+
+
+def analyze_script(
+    loader: Loader,
+    script_path: str,
+    prerequisite_patterns: typing.Union[PatternIndex, typing.List[ExprPattern]],
+    reference_patterns: typing.Union[PatternIndex, typing.List[ExprPattern]],
+    target_patterns: typing.Union[PatternIndex, typing.List[ExprPattern]],
+    states: typing.Union[typing.Dict[str, FileState], None] = None,
+    prefilter: typing.Union[Prefilter, None] = None,
+) -> ScriptAnalysis:
+    """Finds dependencies of a script and records the modules they were found in.
+
+    states memoizes file states across calls so that modules shared by many
+    scripts are hashed once. prefilter, if given, is shared across calls the
+    same way, and so should patterns be indexed once with PatternIndex.
+    """
+    if states is None:
+        states = dict()
+    summaries = FunctionSummaries()
+    with loader.trace() as origins, loader.trace_lookups() as lookups:
+        prerequisites, references, targets = find_dependencies(
+            loader,
+            script_path,
+            prerequisite_patterns,
+            reference_patterns,
+            target_patterns,
+            prefilter,
+            summaries,
+        )
+    inputs = dict()
+    for origin in sorted(loader.dependencies(origins)):
+        if origin not in states:
+            states[origin] = FileState.from_file(origin)
+        inputs[origin] = states[origin]
+        lookups.update(loader.module_lookups.get(origin, ()))
+    # a module added to a searched directory could be found instead of what
+    # the lookup found before, or where it found nothing
+    dirs = dict()
+    for dirpath, name, found in sorted(lookups):
+        if dirpath not in dirs:
+            dirs[dirpath] = DirState.from_dir(dirpath)
+        dirs[dirpath].names[name] = found
+    # names in called functions are resolved against the scope of the caller,
+    # so modules that referenced modules import are assumed to be reached as well
+    modules = sorted(
+        loader.dependencies(
+            origin for origin in summaries.referenced[0] if origin != script_path
+        )
+    )
+    return ScriptAnalysis(prerequisites, references, targets, inputs, modules, dirs)
+
+
+@define
+class AnalysisCache(object):
+    """Analysis results of every script in a stage, saved between runs.
+
+    A result is reused as long as none of the modules it was derived from
+    changed. The key identifies the settings results depend on, results saved
+    under a different key are discarded.
+    """
+
+    filepath: str
+    key: str
+    scripts: typing.Dict[str, ScriptAnalysis] = field(factory=dict)
+
+    @classmethod
+    def load(cls, filepath: str, key: str) -> "AnalysisCache":
+        cache = cls(filepath, key)
+        try:
+            with open(filepath, "r") as f:
+                d = json.load(f)
+        except (OSError, ValueError):
+            return cache
+        if d.get("key") == key:
+            cache.scripts = {
+                script: ScriptAnalysis.from_dict(v)
+                for script, v in d["scripts"].items()
+            }
+        return cache
+
+    def get(self, script_path: str) -> typing.Union[ScriptAnalysis, None]:
+        result = self.scripts.get(script_path)
+        if result is None or not result.is_current():
+            return None
+        return result
+
+    def save(self, scripts: typing.Dict[str, ScriptAnalysis]):
+        self.scripts = scripts
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        tmp_filepath = "%s.%d.tmp" % (self.filepath, os.getpid())
+        with open(tmp_filepath, "w") as f:
+            json.dump(
+                {
+                    "key": self.key,
+                    "scripts": {
+                        script: result.as_dict() for script, result in scripts.items()
+                    },
+                },
+                f,
+            )
+        os.replace(tmp_filepath, self.filepath)
+
+
+# bump whenever saved ScriptAnalysis objects become incompatible
+ANALYSIS_VERSION = 3
+
+
+def analysis_key(
+    search_paths: typing.List[str],
+    prerequisite_patterns: typing.List[ExprPattern],
+    reference_patterns: typing.List[ExprPattern],
+    target_patterns: typing.List[ExprPattern],
+    opaque_modules: typing.Union[typing.List[str], None] = None,
+    opaque_paths: typing.Union[typing.List[str], None] = None,
+) -> str:
+    return hashlib.sha1(
+        json.dumps(
+            [
+                ANALYSIS_VERSION,
+                search_paths,
+                [pat.text for pat in prerequisite_patterns],
+                [pat.text for pat in reference_patterns],
+                [pat.text for pat in target_patterns],
+                opaque_modules or [],
+                opaque_paths or [],
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
@@ -0,0 +1,289 @@
+import os
+from unittest import TestCase
+
+from deba.config import Config, Opaque
+from deba.deps.analysis import AnalysisCache, analyze_script
+from deba.deps.expr import ExprPattern
+from deba.deps.module import Loader, new_loader
+from deba.test_utils import TempDirMixin
+
+
+class AnalysisTestCase(TempDirMixin, TestCase):
+    def analyze(self, loader: Loader, filename: str):
+        return analyze_script(
+            loader,
+            self.file_path(filename),
+            [ExprPattern.from_str(r'read_csv(r"\w+\.csv")')],
+            [],
+            [ExprPattern.from_str(r'`*`.to_csv(r"\w+\.csv")')],
+        )
+
+    def write_files(self):
+        self.write_file("c.py", ["name = 'c.csv'", ""])
+        self.write_file("b.py", ["from c import name", ""])
+        self.write_file("d.py", ["e = 1", ""])
+        self.write_file(
+            "a.py",
+            [
+                "import b",
+                "",
+                "if __name__ == '__main__':",
+                "  df = read_csv(b.name)",
+                "  df.to_csv('a.csv')",
+            ],
+        )
+
+    def test_analyze_script(self):
+        self.write_files()
+        result = self.analyze(Loader([self._dir.name]), "a.py")
+        self.assertEqual(result.prerequisites, ["c.csv"])
+        self.assertEqual(result.references, [])
+        self.assertEqual(result.targets, ["a.csv"])
+        self.assertEqual(
+            sorted(result.inputs.keys()),
+            [self.file_path(name) for name in ["a.py", "b.py", "c.py"]],
+        )
+
+    def test_cache(self):
+        self.write_files()
+        filepath = self.file_path(".deba/analysis/stage.json")
+        cache = AnalysisCache.load(filepath, "key")
+        self.assertIsNone(cache.get(self.file_path("a.py")))
+        cache.save(
+            {self.file_path("a.py"): self.analyze(Loader([self._dir.name]), "a.py")}
+        )
+
+        cache = AnalysisCache.load(filepath, "key")
+        result = cache.get(self.file_path("a.py"))
+        self.assertEqual(result.prerequisites, ["c.csv"])
+        self.assertIsNone(
+            AnalysisCache.load(filepath, "other").get(self.file_path("a.py"))
+        )
+
+        # same content, different modification time
+        os.utime(self.file_path("c.py"), ns=(0, 0))
+        self.assertIsNotNone(cache.get(self.file_path("a.py")))
+
+        self.write_file("c.py", ["name = 'd.csv'", ""])
+        self.assertIsNone(cache.get(self.file_path("a.py")))
+
+    def test_package_submodules(self):
+        self.write_file("lib/__init__.py", [""])
+        self.write_file("lib/names.py", ["name = 'c.csv'", ""])
+        self.write_file("lib/unused.py", ["this is not python", ""])
+        for script in ["a.py", "b.py"]:
+            self.write_file(
+                script,
+                [
+                    "from lib import names",
+                    "",
+                    "if __name__ == '__main__':",
+                    "  df = read_csv(names.name)",
+                    "  df.to_csv('%s')" % script.replace(".py", ".csv"),
+                ],
+            )
+        loader = Loader([self._dir.name])
+        for script in ["a.py", "b.py"]:
+            result = self.analyze(loader, script)
+            self.assertEqual(result.prerequisites, ["c.csv"])
+            self.assertEqual(
+                sorted(result.inputs.keys()),
+                [
+                    self.file_path(name)
+                    for name in [script, "lib/__init__.py", "lib/names.py"]
+                ],
+            )
+
+    def test_evict(self):
+        self.write_files()
+        self.write_file(
+            "e.py",
+            [
+                "import b",
+                "",
+                "if __name__ == '__main__':",
+                "  df = read_csv(b.name)",
+                "  df.to_csv('e.csv')",
+            ],
+        )
+        loader = Loader([self._dir.name], max_memory=0)
+        for script in ["a.py", "e.py", "a.py"]:
+            result = self.analyze(loader, script)
+            self.assertEqual(result.prerequisites, ["c.csv"])
+            self.assertEqual(
+                sorted(result.inputs.keys()),
+                [self.file_path(name) for name in sorted([script, "b.py", "c.py"])],
+            )
+            loader.evict(self.file_path(script))
+            self.assertEqual(loader.module_asts, {})
+            self.assertEqual(loader.module_nodes, {})
+
+        loader = Loader([self._dir.name], max_memory=1 << 20)
+        self.analyze(loader, "a.py")
+        loader.evict(self.file_path("a.py"))
+        self.assertEqual(len(loader.module_asts), 3)
+        loader.max_memory = os.stat(self.file_path("b.py")).st_size * 30
+        loader.evict(self.file_path("a.py"))
+        # the script goes first, then modules that were used least recently
+        self.assertEqual(list(loader.module_asts.keys()), [self.file_path("b.py")])
+
+    def test_opaque_modules(self):
+        self.write_file("vendor/__init__.py", ["this is not python", ""])
+        self.write_file("vendor/lib.py", ["this is not python either", ""])
+        self.write_file("gen/__init__.py", [""])
+        self.write_file("gen/names.py", ["name = 'c.csv'", ""])
+        self.write_file("lib/__init__.py", [""])
+        self.write_file("lib/names.py", ["name = 'd.csv'", ""])
+        self.write_file(
+            "a.py",
+            [
+                "import vendor",
+                "from vendor.lib import load",
+                "from gen import names",
+                "from lib import names as lib_names",
+                "",
+                "if __name__ == '__main__':",
+                "  df = read_csv(names.name)",
+                "  df = read_csv(lib_names.name)",
+                "  df.to_csv('a.csv')",
+            ],
+        )
+        conf = Config(
+            stages=[],
+            root_dir=self._dir.name,
+            opaque=Opaque(modules=["vend*"], paths=["gen"]),
+        )
+        loader = new_loader(conf)
+        result = self.analyze(loader, "a.py")
+        self.assertEqual(result.prerequisites, ["d.csv"])
+        self.assertEqual(
+            sorted(result.inputs.keys()),
+            [
+                self.file_path(name)
+                for name in ["a.py", "lib/__init__.py", "lib/names.py"]
+            ],
+        )
+        self.assertEqual(
+            sorted(loader.module_asts.keys()),
+            [
+                self.file_path(name)
+                for name in ["a.py", "lib/__init__.py", "lib/names.py"]
+            ],
+        )
+        self.assertEqual(
+            loader.module_name(self.file_path("vendor/lib.py")), "vendor.lib"
+        )
+        self.assertEqual(
+            loader.module_name(self.file_path("vendor/__init__.py")), "vendor"
+        )
+
+    def test_called_modules(self):
+        self.write_file("lib/__init__.py", [""])
+        self.write_file(
+            "lib/io.py",
+            [
+                "from lib.names import input_name",
+                "",
+                "def load():",
+                "  return read_csv(input_name())",
+                "",
+            ],
+        )
+        self.write_file("lib/names.py", ["def input_name():", "  return 'c.csv'", ""])
+        self.write_file("lib/save.py", ["def save(df):", "  df.to_csv('a.csv')", ""])
+        self.write_file("lib/unused.py", ["def unused():", "  pass", ""])
+        self.write_file(
+            "a.py",
+            [
+                "from lib.io import load",
+                "from lib.save import save",
+                "from lib.unused import unused",
+                "",
+                "def main():",
+                "  df = load()",
+                "  save(df)",
+                "",
+                "if __name__ == '__main__':",
+                "  main()",
+            ],
+        )
+        loader = Loader([self._dir.name])
+        result = self.analyze(loader, "a.py")
+        self.assertEqual(result.targets, ["a.csv"])
+        self.assertEqual(
+            result.modules,
+            [
+                self.file_path(name)
+                for name in ["lib/io.py", "lib/names.py", "lib/save.py"]
+            ],
+        )
+        # memoized function summaries report the same modules
+        self.assertEqual(self.analyze(loader, "a.py").modules, result.modules)
+
+    def test_referenced_modules(self):
+        self.write_file("lib/__init__.py", [""])
+        self.write_file("lib/paths.py", ["IN = 'in.csv'", ""])
+        self.write_file("lib/consts.py", ["SEP = ';'", ""])
+        self.write_file(
+            "a.py",
+            [
+                "import lib.consts as consts",
+                "from lib.paths import IN",
+                "",
+                "if __name__ == '__main__':",
+                "  df = read_csv(IN)",
+                "  df.to_csv('out.csv', sep=consts.SEP)",
+            ],
+        )
+        loader = Loader([self._dir.name])
+        result = self.analyze(loader, "a.py")
+        self.assertEqual(result.prerequisites, ["in.csv"])
+        self.assertEqual(result.targets, ["out.csv"])
+        self.assertEqual(
+            result.modules,
+            [self.file_path(name) for name in ["lib/consts.py", "lib/paths.py"]],
+        )
+
+    def test_module_lookups(self):
+        self.write_file("src/other.py", [""])
+        self.write_file("paths.py", ["NAME = 'in.csv'", ""])
+        self.write_file(
+            "a.py",
+            [
+                "import pandas",
+                "from paths import NAME",
+                "",
+                "if __name__ == '__main__':",
+                "  df = read_csv(NAME)",
+            ],
+        )
+        script_path = self.file_path("a.py")
+        loader = Loader([self.file_path("src"), self._dir.name])
+        result = self.analyze(loader, "a.py")
+        self.assertEqual(result.prerequisites, ["in.csv"])
+        self.assertEqual(
+            result.dirs[self.file_path("src")].names,
+            {"a": False, "pandas": False, "paths": False},
+        )
+        self.assertEqual(
+            result.dirs[self._dir.name].names,
+            {"a": True, "pandas": False, "paths": True},
+        )
+        filepath = self.file_path(".deba/analysis/stage.json")
+        AnalysisCache.load(filepath, "key").save({script_path: result})
+        cache = AnalysisCache.load(filepath, "key")
+        self.assertIsNotNone(cache.get(script_path))
+
+        # entries that no lookup was looking for don't matter
+        self.write_file("src/notes.txt", [""])
+        self.assertIsNotNone(cache.get(script_path))
+
+        # a module that shadows the one that was found
+        self.write_file("src/paths.py", ["NAME = 'other.csv'", ""])
+        self.assertIsNone(cache.get(script_path))
+        os.remove(self.file_path("src/paths.py"))
+        self.assertIsNotNone(cache.get(script_path))
+
+        # a module where none was found
+        self.write_file("pandas.py", [""])
+        self.assertIsNone(cache.get(script_path))
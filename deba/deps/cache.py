@@ -0,0 +1,180 @@
+import ast
+import copy
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import time
+import typing
+
+from attrs import define
+
+
+def _lazy_body(cls):
+    """Makes the body of function definitions load from a pickled blob on first access.
+
+    The class keeps the name of the ast class it derives from so that
+    ast.dump output is the same as for a freshly parsed tree.
+    """
+
+    def get_body(self):
+        d = self.__dict__
+        if "_body" not in d:
+            d["_body"] = pickle.loads(d.pop("_body_blob"))
+        return d["_body"]
+
+    def set_body(self, value):
+        self.__dict__.pop("_body_blob", None)
+        self.__dict__["_body"] = value
+
+    cls.body = property(get_body, set_body)
+    return cls
+
+
+@_lazy_body
+class FunctionDef(ast.FunctionDef):
+    pass
+
+
+@_lazy_body
+class AsyncFunctionDef(ast.AsyncFunctionDef):
+    pass
+
+
+_lazy_classes = {
+    ast.FunctionDef: FunctionDef,
+    ast.AsyncFunctionDef: AsyncFunctionDef,
+}
+
+
+def _summarize(stmts: typing.List[ast.stmt]) -> typing.List[ast.stmt]:
+    results = []
+    for stmt in stmts:
+        lazy_cls = _lazy_classes.get(type(stmt))
+        if lazy_cls is not None:
+            node = lazy_cls(
+                **{k: v for k, v in ast.iter_fields(stmt) if k != "body"},
+                **{k: getattr(stmt, k) for k in stmt._attributes if hasattr(stmt, k)}
+            )
+            node.__dict__["_body_blob"] = pickle.dumps(
+                stmt.body, protocol=pickle.HIGHEST_PROTOCOL
+            )
+            results.append(node)
+        elif isinstance(stmt, ast.ClassDef):
+            node = copy.copy(stmt)
+            node.body = _summarize(stmt.body)
+            results.append(node)
+        else:
+            results.append(stmt)
+    return results
+
+
+# bump whenever _summarize or the lazy classes change how entries are pickled
+CACHE_VERSION = 1
+
+# entries that weren't used for this many seconds are pruned
+MAX_AGE = 30 * 24 * 3600
+
+# the cache is pruned at most once in this many seconds, which is also how
+# stale the modification time of an entry can get before a load refreshes it
+PRUNE_INTERVAL = 24 * 3600
+
+
+@define
+class ASTCache(object):
+    """On-disk cache of parsed modules, keyed by source content.
+
+    Function bodies are pickled separately and only unpickled when accessed,
+    therefore loading a module that is only imported for a few names costs a
+    fraction of parsing it. Entries are written to a temporary file and
+    renamed into place, so concurrent processes never read a partially
+    written entry.
+
+    Loading an entry refreshes its modification time, so entries of sources
+    that no longer exist eventually age out when the cache is pruned.
+    """
+
+    dirpath: str
+
+    def key(self, content: bytes) -> str:
+        h = hashlib.sha1(
+            ("%d-%s" % (CACHE_VERSION, sys.implementation.cache_tag)).encode("ascii")
+        )
+        h.update(content)
+        return h.hexdigest()
+
+    def filepath(self, key: str) -> str:
+        return os.path.join(self.dirpath, key[:2], "%s.pickle" % key)
+
+    def load(self, key: str) -> typing.Union[ast.Module, None]:
+        filepath = self.filepath(key)
+        try:
+            with open(filepath, "rb") as f:
+                mtime = os.fstat(f.fileno()).st_mtime
+                mod = pickle.load(f)
+        except Exception:
+            return None
+        if time.time() - mtime > PRUNE_INTERVAL:
+            try:
+                os.utime(filepath)
+            except OSError:
+                pass
+        return mod
+
+    def save(self, key: str, mod: ast.Module):
+        summary = ast.Module(body=_summarize(mod.body), type_ignores=mod.type_ignores)
+        filepath = self.filepath(key)
+        dirpath = os.path.dirname(filepath)
+        try:
+            os.makedirs(dirpath, exist_ok=True)
+            fd, tmp_filepath = tempfile.mkstemp(dir=dirpath, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(summary, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_filepath, filepath)
+            except BaseException:
+                os.unlink(tmp_filepath)
+                raise
+        except OSError:
+            pass
+
+    def prune(self, max_age: float = MAX_AGE) -> int:
+        """Removes entries that weren't used for max_age seconds.
+
+        Does nothing if the cache was pruned less than PRUNE_INTERVAL seconds
+        ago. Returns the number of removed entries.
+        """
+        marker = os.path.join(self.dirpath, "pruned")
+        now = time.time()
+        try:
+            if now - os.stat(marker).st_mtime < PRUNE_INTERVAL:
+                return 0
+        except OSError:
+            pass
+        removed = 0
+        try:
+            with os.scandir(self.dirpath) as it:
+                subdirs = [entry.path for entry in it if entry.is_dir()]
+        except OSError:
+            return 0
+        for subdir in subdirs:
+            try:
+                with os.scandir(subdir) as it:
+                    for entry in it:
+                        # temporary files are left behind by interrupted saves
+                        age = PRUNE_INTERVAL if entry.name.endswith(".tmp") else max_age
+                        if now - entry.stat().st_mtime > age:
+                            os.unlink(entry.path)
+                            removed += 1
+                if not os.listdir(subdir):
+                    os.rmdir(subdir)
+            except OSError:
+                pass
+        try:
+            with open(marker, "a"):
+                pass
+            os.utime(marker)
+        except OSError:
+            pass
+        return removed
@@ -0,0 +1,107 @@
+import ast
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from deba.deps.cache import MAX_AGE, PRUNE_INTERVAL, ASTCache
+from deba.deps.module import Loader
+from deba.test_utils import ASTMixin, TempDirMixin
+
+
+class ASTCacheTestCase(ASTMixin, TempDirMixin, TestCase):
+    def test_save_load(self):
+        cache = ASTCache(self.file_path("cache"))
+        key = cache.key(b"a = 1")
+        self.assertNotEqual(key, cache.key(b"a = 2"))
+        with patch("deba.deps.cache.CACHE_VERSION", 0):
+            self.assertNotEqual(key, cache.key(b"a = 1"))
+        self.assertIsNone(cache.load(key))
+
+        mod = ast.parse("a = 1")
+        cache.save(key, mod)
+        self.assertASTEqual(cache.load(key), mod)
+        self.assertEqual(
+            os.listdir(os.path.dirname(cache.filepath(key))), ["%s.pickle" % key]
+        )
+
+    def test_prune(self):
+        cache = ASTCache(self.file_path("cache"))
+        keys = [cache.key(b"a = %d" % i) for i in range(3)]
+        for key in keys:
+            cache.save(key, ast.parse("a = 1"))
+        tmp_filepath = os.path.join(os.path.dirname(cache.filepath(keys[0])), "x.tmp")
+        with open(tmp_filepath, "wb"):
+            pass
+        now = time.time()
+        for filepath, age in [
+            (cache.filepath(keys[0]), MAX_AGE + 10),
+            (cache.filepath(keys[1]), MAX_AGE - 10),
+            (cache.filepath(keys[2]), MAX_AGE + 10),
+            (tmp_filepath, PRUNE_INTERVAL + 10),
+        ]:
+            os.utime(filepath, (now - age, now - age))
+
+        # loading an entry keeps it
+        self.assertIsNotNone(cache.load(keys[2]))
+        self.assertEqual(cache.prune(), 2)
+        self.assertIsNone(cache.load(keys[0]))
+        self.assertIsNotNone(cache.load(keys[1]))
+        self.assertIsNotNone(cache.load(keys[2]))
+        self.assertFalse(os.path.exists(tmp_filepath))
+
+        # pruned at most once per interval
+        os.utime(cache.filepath(keys[1]), (now - MAX_AGE - 10,) * 2)
+        self.assertEqual(cache.prune(), 0)
+        marker = os.path.join(cache.dirpath, "pruned")
+        os.utime(marker, (now - PRUNE_INTERVAL - 10,) * 2)
+        self.assertEqual(cache.prune(), 1)
+        self.assertEqual(
+            sorted(os.listdir(cache.dirpath)), sorted([keys[2][:2], "pruned"])
+        )
+
+    def test_lazy_function_body(self):
+        cache = ASTCache(self.file_path("cache"))
+        src = "\n".join(
+            [
+                "class A:",
+                "  @classmethod",
+                "  def f(cls):",
+                "    return read_csv('a.csv')",
+                "",
+                "async def g(a: int) -> int:",
+                "  return a",
+                "",
+            ]
+        )
+        key = cache.key(src.encode("utf-8"))
+        cache.save(key, ast.parse(src))
+
+        mod = cache.load(key)
+        func = mod.body[0].body[0]
+        self.assertIsInstance(func, ast.FunctionDef)
+        self.assertIn("_body_blob", func.__dict__)
+        self.assertEqual(
+            ast.dump(mod, include_attributes=True),
+            ast.dump(ast.parse(src), include_attributes=True),
+        )
+        self.assertNotIn("_body_blob", func.__dict__)
+        self.assertIsInstance(mod.body[1], ast.AsyncFunctionDef)
+
+    def test_loader_uses_cache(self):
+        self.write_file("a.py", ["a = 1"])
+        cache = ASTCache(self.file_path(".deba/cache"))
+        mod = Loader([self._dir.name], cache=cache).parse_ast(self.file_path("a.py"))
+
+        with patch("ast.parse") as mock_parse:
+            self.assertASTEqual(
+                Loader([self._dir.name], cache=cache).parse_ast(self.file_path("a.py")),
+                mod,
+            )
+        mock_parse.assert_not_called()
+
+        self.write_file("a.py", ["a = 2"])
+        self.assertASTEqual(
+            Loader([self._dir.name], cache=cache).parse_ast(self.file_path("a.py")),
+            ast.parse("a = 2"),
+        )
@@ -2,12 +2,14 @@ import re
 import itertools
 import typing
 import ast
-from fnmatch import fnmatchcase
+from fnmatch import fnmatchcase, translate
 import logging
 
-from attrs import define, field
+from attrs import define, field, fields
 from deba.attrs_utils import field_transformer, doc
-from deba.deps.module import Stack
+
+if typing.TYPE_CHECKING:
+    from deba.deps.module import Stack
 
 
 logger = logging.getLogger("deba")
@@ -23,6 +25,8 @@ class ExprPattern(object):
     text: str = field()
     file_pat: object = field()
     patterns: typing.List[str] = field(factory=list)
+    # matcher compiled from node, see compile_node. Not pickled
+    _matcher: object = field(default=None, init=False, eq=False, repr=False)
     backtick_name_pat: typing.ClassVar[object] = re.compile(
         r"^deba_backtick_pat_(\d{3})$"
     )
@@ -100,7 +104,19 @@ class ExprPattern(object):
                     raise ExprTemplateParseError(
                         "expect exactly 1 expression, found %d" % len(mod.body)
                     )
-                return cls(text=orig_text, patterns=patterns, node=mod.body[0].value)
+                pat = cls(text=orig_text, patterns=patterns, node=mod.body[0].value)
+                pat._matcher = pat.compile_node(pat.node)
+                return pat
+
+    def __getstate__(self):
+        # compiled matchers are closures that can't be pickled, compile them again
+        # once they are needed
+        return tuple(getattr(self, a.name) for a in fields(type(self)) if a.init)
+
+    def __setstate__(self, state):
+        for a, value in zip([a for a in fields(type(self)) if a.init], state):
+            object.__setattr__(self, a.name, value)
+        object.__setattr__(self, "_matcher", None)
 
     def match_constant(
         self, node1: ast.Constant, node2: ast.Constant
@@ -113,7 +129,7 @@ class ExprPattern(object):
         return "", node1.value == node2.value
 
     def match_ast(
-        self, scopes: Stack, node1: ast.AST, node2: ast.AST
+        self, scopes: "Stack", node1: ast.AST, node2: ast.AST
     ) -> typing.Tuple[str, bool]:
         if isinstance(node1, ast.Constant):
             if isinstance(node2, ast.Constant):
@@ -183,10 +199,173 @@ class ExprPattern(object):
         else:
             return "", node1 == node2
 
-    def match_node(self, scopes: Stack, node: ast.AST) -> typing.Union[None, str]:
-        s, ok = self.match_ast(scopes, self.node, node)
-        if ok:
-            return s
+    def compile_node(
+        self, node1: typing.Any
+    ) -> typing.Callable[["Stack", typing.Any], typing.Union[str, None]]:
+        """Compiles node1 into a function that matches it against another node.
+
+        The function behaves exactly like match_ast with node1 as the pattern
+        side, except that it returns the matched string or None if there is no
+        match. Only fields that node1 constrains are checked.
+        """
+        if isinstance(node1, ast.Constant):
+            # constants of patterns are always regular expressions
+            match_file = self.file_pat.match
+
+            def match_constant(scopes: "Stack", node2):
+                if not isinstance(node2, ast.Constant):
+                    node = scopes.dereference(node2)
+                    if node is None or not isinstance(node.ast, ast.Constant):
+                        return None
+                    node2 = node.ast
+                value = node2.value
+                if type(value) is str and match_file(value) is not None:
+                    return value
+                return None
+
+            return match_constant
+
+        node_type = type(node1)
+        if isinstance(node1, ast.Name):
+            name, ctx_type = node1.id, type(node1.ctx)
+            m = ExprPattern.backtick_name_pat.match(name)
+            glob = (
+                None
+                if m is None
+                else re.compile(translate(self.patterns[int(m.group(1))])).match
+            )
+
+            def match_name(scopes: "Stack", node2):
+                if type(node2) is not node_type or type(node2.ctx) is not ctx_type:
+                    return None
+                if node2.id == name or (glob is not None and glob(node2.id)):
+                    return ""
+                return None
+
+            return match_name
+
+        if isinstance(node1, ast.Call):
+            match_func = self.compile_node(node1.func)
+            if len(node1.args) > 0:
+                match_arg, field_name = self.compile_node(node1.args[0]), "args"
+            elif len(node1.keywords) > 0:
+                match_arg, field_name = self.compile_node(node1.keywords[0]), "keywords"
+            else:
+                match_arg, field_name = None, None
+
+            def match_call(scopes: "Stack", node2):
+                if type(node2) is not node_type:
+                    return None
+                if match_func(scopes, node2.func) is None:
+                    return None
+                if match_arg is None:
+                    return ""
+                for arg in getattr(node2, field_name):
+                    v = match_arg(scopes, arg)
+                    if v is not None:
+                        return v
+                return None
+
+            return match_call
+
+        if isinstance(node1, ast.AST):
+            fields = [(k, self.compile_node(v)) for k, v in ast.iter_fields(node1)]
+
+            def match_fields(scopes: "Stack", node2):
+                if type(node2) is not node_type:
+                    return None
+                s = ""
+                for k, match_field in fields:
+                    v = match_field(scopes, getattr(node2, k))
+                    if v is None:
+                        return None
+                    if v != "":
+                        s = v
+                return s
+
+            return match_fields
+
+        if isinstance(node1, list):
+            items = [self.compile_node(v) for v in node1]
+            match_none = self.compile_node(None)
+
+            def match_list(scopes: "Stack", node2):
+                if type(node2) is not node_type:
+                    return None
+                s = ""
+                for idx in range(max(len(items), len(node2))):
+                    match_item = items[idx] if idx < len(items) else match_none
+                    v = match_item(scopes, node2[idx] if idx < len(node2) else None)
+                    if v is None:
+                        return None
+                    if v != "":
+                        s = v
+                return s
+
+            return match_list
+
+        def match_value(scopes: "Stack", node2):
+            if type(node2) is node_type and node1 == node2:
+                return ""
+            return None
+
+        return match_value
+
+    def match_node(self, scopes: "Stack", node: ast.AST) -> typing.Union[None, str]:
+        if self._matcher is None:
+            self._matcher = self.compile_node(self.node)
+        return self._matcher(scopes, node)
+
+
+def callee_key(func: ast.AST) -> typing.Tuple[str, typing.Union[str, None]]:
+    """Returns the shape of a callee that decides which patterns could match it."""
+    if isinstance(func, ast.Name):
+        return "name", func.id
+    if isinstance(func, ast.Attribute):
+        return "attr", func.attr
+    return "type", type(func).__name__
+
+
+@define
+class PatternIndex(object):
+    """Expression patterns grouped by the shape of their outermost callee.
+
+    A pattern can only match a call whose callee has the same type, and the
+    same name or attribute unless its name is a backtick pattern. Candidates
+    of a call are returned in their original order so that the first match
+    stays the same as when trying every pattern.
+    """
+
+    patterns: typing.List[ExprPattern] = field(factory=list)
+    _buckets: typing.Dict[typing.Tuple, typing.List[int]] = field(
+        init=False, factory=dict
+    )
+    _wildcards: typing.List[int] = field(init=False, factory=list)
+    _candidates: typing.Dict[typing.Tuple, typing.List[ExprPattern]] = field(
+        init=False, factory=dict
+    )
+
+    def __attrs_post_init__(self):
+        for idx, pat in enumerate(self.patterns):
+            func = pat.node.func
+            if (
+                isinstance(func, ast.Name)
+                and ExprPattern.backtick_name_pat.match(func.id) is not None
+            ):
+                self._wildcards.append(idx)
+            else:
+                self._buckets.setdefault(callee_key(func), []).append(idx)
+
+    def candidates(self, call: ast.Call) -> typing.List[ExprPattern]:
+        key = callee_key(call.func)
+        result = self._candidates.get(key)
+        if result is None:
+            indices = self._buckets.get(key, [])
+            if key[0] == "name":
+                indices = sorted(indices + self._wildcards)
+            result = [self.patterns[idx] for idx in indices]
+            self._candidates[key] = result
+        return result
 
 
 def expr_templates(l: typing.Union[typing.List[str], None]) -> typing.List[ExprPattern]:
@@ -1,11 +1,12 @@
 from importlib.machinery import ModuleSpec, SourceFileLoader
 from unittest import TestCase
+import pickle
 import re
 import typing
 import ast
 
 from attrs import define
-from deba.deps.expr import ExprPattern, ExprTemplateParseError
+from deba.deps.expr import ExprPattern, ExprTemplateParseError, PatternIndex
 from deba.deps.module import Node, Stack
 from deba.test_utils import ASTMixin
 
@@ -185,3 +186,111 @@ class ExprTemplateTestCase(ASTMixin, TestCase):
                 case.file,
                 "(case %d) %s" % (idx, repr(case)),
             )
+
+    def test_pattern_index(self):
+        patterns = [
+            ExprPattern.from_str(s)
+            for s in [
+                r"`*`.to_csv(r'.+\.csv')",
+                r"read_csv(r'.+\.csv')",
+                r"`save_*`(r'.+\.csv')",
+                r"pd.read_csv(r'.+\.tsv')",
+                r"`*`.read_csv(r'.+\.csv')",
+                r"save_user(r'.+\.pdf')",
+                r"`*`.to_csv(path=r'.+\.pdf')",
+                r"`*`[key](r'.+\.csv')",
+            ]
+        ]
+        index = PatternIndex(patterns)
+        for source in [
+            "df.to_csv('abc.csv')",
+            "df.to_csv(path='abc.pdf')",
+            "to_csv('abc.csv')",
+            "read_csv('abc.csv')",
+            "pd.read_csv('abc.tsv')",
+            "pd.read_csv('abc.csv')",
+            "save_user('abc.pdf')",
+            "save_user('abc.csv')",
+            "load_user('abc.csv')",
+            "funcs[key]('abc.csv')",
+            "get_func()('abc.csv')",
+        ]:
+            node = ast.parse(source).body[0].value
+            expected = [pat for pat in patterns if pat.match_node(Stack(), node)]
+            candidates = index.candidates(node)
+            self.assertEqual(
+                [pat for pat in candidates if pat.match_node(Stack(), node)],
+                expected,
+                source,
+            )
+            self.assertEqual(
+                candidates, [pat for pat in patterns if pat in candidates], source
+            )
+        self.assertEqual(
+            [
+                pat.text
+                for pat in index.candidates(ast.parse("df.load('a')").body[0].value)
+            ],
+            [],
+        )
+
+    def test_compiled_matcher(self):
+        spec = ModuleSpec("a", loader=SourceFileLoader("a", "a"))
+        scopes = Stack(
+            [
+                {
+                    "a": Node(ast.Constant(value="file_a.csv"), spec),
+                    "n": Node(ast.Constant(value=1), spec),
+                }
+            ]
+        )
+        templates = [
+            r"read_csv(r'.+\.csv')",
+            r"`*`.to_csv(r'.+\.csv')",
+            r"`save_*`(r'.+\.csv')",
+            r"`do_*`(`does_*`(kw=r'.+\.pdf'))",
+            r"pd.read_csv(sep=r'.+')",
+            r"`*`[`*`](r'.+\.csv')",
+            r"open([r'.+\.txt'])",
+            r"load({`k`: r'.+\.json'})",
+        ]
+        sources = [
+            "read_csv('abc.csv')",
+            "read_csv('abc.csvl')",
+            "read_csv(a)",
+            "read_csv(n)",
+            "read_csv(1, 'abc.csv')",
+            "df.to_csv('abc.csv', index=False)",
+            "df.to_csv(a)",
+            "to_csv('abc.csv')",
+            "save_user('abc.csv')",
+            "load_user('abc.csv')",
+            "do_abc(123, does_xyz('abc', kw='qwe.pdf'))",
+            "do_abc(does_xyz(kw=a))",
+            "pd.read_csv('x.csv', sep='\\t')",
+            "pd.read_csv('x.csv')",
+            "funcs[key]('abc.csv')",
+            "funcs[0]('abc.csv')",
+            "open(['a.txt'])",
+            "open(['a.txt', 'b.txt'])",
+            "open([])",
+            "load({k: 'a.json'})",
+            "load({k: 'a.json', **d})",
+            "load({**d})",
+        ]
+        for template in templates:
+            et = ExprPattern.from_str(template)
+            restored = pickle.loads(pickle.dumps(et))
+            self.assertEqual(restored.text, et.text)
+            for source in sources:
+                node = ast.parse(source).body[0].value
+                s, ok = et.match_ast(scopes, et.node, node)
+                expected = s if ok else None
+                self.assertEqual(
+                    et.match_node(scopes, node), expected, "%s %s" % (template, source)
+                )
+                self.assertEqual(
+                    restored.match_node(scopes, node),
+                    expected,
+                    "%s %s" % (template, source),
+                )
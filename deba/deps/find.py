@@ -4,9 +4,12 @@ from importlib.machinery import ModuleSpec
 import typing
 import logging
 
+from attrs import define, field
+
 from deba.deps.module import Loader, Node, Stack
 
-from deba.deps.expr import ExprPattern
+from deba.deps.expr import ExprPattern, PatternIndex
+from deba.deps.prefilter import Prefilter
 
 
 logger = logging.getLogger("deba")
@@ -53,11 +56,23 @@ def build_module_from_filepath(loader: Loader, filepath: str) -> Node:
 def find_dependencies(
     loader: Loader,
     filepath: str,
-    prerequisite_patterns: typing.List[ExprPattern],
-    reference_patterns: typing.List[ExprPattern],
-    target_patterns: typing.List[ExprPattern],
+    prerequisite_patterns: typing.Union[PatternIndex, typing.List[ExprPattern]],
+    reference_patterns: typing.Union[PatternIndex, typing.List[ExprPattern]],
+    target_patterns: typing.Union[PatternIndex, typing.List[ExprPattern]],
+    prefilter: typing.Union[Prefilter, None] = None,
+    summaries: typing.Union["FunctionSummaries", None] = None,
 ) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """Finds dependencies in the main block of the script at filepath.
+
+    If summaries is given, origins of modules that define whatever the main
+    block refers to are collected in summaries.referenced[0]. Pattern lists
+    are indexed on every call, pass a PatternIndex to scan many scripts.
+    """
     module_node = build_module_from_filepath(loader, filepath)
+    prerequisite_patterns, reference_patterns, target_patterns = (
+        pats if isinstance(pats, PatternIndex) else PatternIndex(pats)
+        for pats in (prerequisite_patterns, reference_patterns, target_patterns)
+    )
     stack = Stack()
     for stmt in module_node.ast.body:
         if is_main_block(stmt):
@@ -69,6 +84,8 @@ def find_dependencies(
                 prerequisite_patterns,
                 reference_patterns,
                 target_patterns,
+                FunctionSummaries() if summaries is None else summaries,
+                prefilter,
             )
         else:
             loader.populate_scope(module_node.spec, stack, module_node.ast, stmt)
@@ -78,10 +95,10 @@ def find_dependencies(
 def scan_patterns(
     stack: Stack,
     call: ast.Call,
-    patterns: typing.List[ExprPattern],
+    patterns: PatternIndex,
     extracted: typing.List[str],
 ) -> bool:
-    for tmpl in patterns:
+    for tmpl in patterns.candidates(call):
         s = tmpl.match_node(stack, call)
         if s is not None:
             extracted.append(s)
@@ -89,40 +106,287 @@ def scan_patterns(
     return False
 
 
+@define
+class FunctionSummary(object):
+    """Dependencies found in a function body, along with the names they depend on.
+
+    names are every name read by the scan, including names read in functions
+    it called, and bindings are what they were bound to at the call site.
+    Bindings are kept alive along with the summary so that their ids are not
+    reused.
+    """
+
+    names: typing.Tuple[str, ...]
+    bindings: typing.Tuple
+    binding_ids: typing.Tuple[int, ...]
+    prerequisites: typing.List[str]
+    references: typing.List[str]
+    targets: typing.List[str]
+    origins: typing.Set[str]
+    referenced: typing.Set[str]
+
+    def matches(self, stack: Stack) -> bool:
+        for name, value_id in zip(self.names, self.binding_ids):
+            if binding_id(stack.get_value(name)) != value_id:
+                return False
+        return True
+
+
+@define
+class FunctionSummaries(object):
+    """Dependencies found in function bodies, memoized for the duration of a scan.
+
+    Names in a function body are resolved against the scope of its caller, and
+    so are names in the functions it calls. A summary is therefore only reused
+    at call sites where every name its scan read is bound to the same value.
+    """
+
+    # id of function -> summaries of its scans
+    results: typing.Dict[int, typing.List[FunctionSummary]] = field(factory=dict)
+    names: typing.Dict[int, typing.List[str]] = field(factory=dict)
+    # ids of functions being scanned, innermost last
+    in_progress: typing.List[int] = field(factory=list)
+    # index of the outermost function in progress each scan ran into recursively
+    lowlinks: typing.List[int] = field(factory=list)
+    # origins of modules that define whatever names refer to, one set per scan
+    # in progress, outermost first
+    referenced: typing.List[typing.Set[str]] = field(factory=lambda: [set()])
+    # names read by functions called so far, one set per scan in progress,
+    # outermost first
+    reads: typing.List[typing.Set[str]] = field(factory=lambda: [set()])
+
+    def own_names(self, func: ast.AST) -> typing.List[str]:
+        names = self.names.get(id(func))
+        if names is None:
+            names = sorted({t.id for t in ast.walk(func) if isinstance(t, ast.Name)})
+            self.names[id(func)] = names
+        return names
+
+    def get(self, func: ast.AST, stack: Stack) -> typing.Union[FunctionSummary, None]:
+        for summary in self.results.get(id(func), []):
+            if summary.matches(stack):
+                return summary
+        return None
+
+    def put(
+        self,
+        func: ast.AST,
+        stack: Stack,
+        names: typing.Set[str],
+        prerequisites: typing.List[str],
+        references: typing.List[str],
+        targets: typing.List[str],
+        origins: typing.Set[str],
+        referenced: typing.Set[str],
+    ):
+        names = tuple(sorted(names))
+        bindings = tuple(stack.get_value(name) for name in names)
+        self.results.setdefault(id(func), []).append(
+            FunctionSummary(
+                names,
+                bindings,
+                tuple(binding_id(v) for v in bindings),
+                prerequisites,
+                references,
+                targets,
+                origins,
+                referenced,
+            )
+        )
+
+    def enter(self, func: ast.AST) -> bool:
+        """Marks func as being scanned, returns False if it already is."""
+        for idx, func_id in enumerate(self.in_progress):
+            if func_id == id(func):
+                self.lowlinks[-1] = min(self.lowlinks[-1], idx)
+                return False
+        self.in_progress.append(id(func))
+        self.lowlinks.append(len(self.in_progress) - 1)
+        return True
+
+    def leave(self) -> bool:
+        """Ends the innermost scan, returns True if its result is complete.
+
+        A result is incomplete if the scan skipped a recursive call to a
+        function whose own scan had not finished yet.
+        """
+        idx = len(self.in_progress) - 1
+        self.in_progress.pop()
+        lowlink = self.lowlinks.pop()
+        if self.lowlinks:
+            self.lowlinks[-1] = min(self.lowlinks[-1], lowlink)
+        return lowlink >= idx
+
+
+def binding_id(value: typing.Union[object, None]) -> int:
+    # plain nodes are recreated whenever a scope is populated, compare what they wrap
+    if isinstance(value, Node) and value.children is None:
+        return id(value.ast)
+    return id(value)
+
+
+def scan_function(
+    loader: Loader,
+    func: Node,
+    stack: Stack,
+    prerequisite_patterns: PatternIndex,
+    reference_patterns: PatternIndex,
+    target_patterns: PatternIndex,
+    summaries: FunctionSummaries,
+    prefilter: typing.Union[Prefilter, None] = None,
+) -> typing.Tuple[typing.List[str], typing.List[str], typing.List[str]]:
+    """Finds dependencies in the body of a called function.
+
+    Summaries are reused for calls that see the same bindings. Recursive calls
+    are not followed.
+    """
+    summary = summaries.get(func.ast, stack)
+    if summary is not None:
+        for origin in summary.origins:
+            loader.record(origin)
+        summaries.referenced[-1].update(summary.referenced)
+        summaries.reads[-1].update(summary.names)
+        return summary.prerequisites, summary.references, summary.targets
+    if not summaries.enter(func.ast):
+        logger.debug("skipping recursive call to %s", func.ast.name)
+        return [], [], []
+    summaries.referenced.append(set())
+    summaries.reads.append(set(summaries.own_names(func.ast)))
+    try:
+        with loader.trace() as origins:
+            pre, ref, tar = scan(
+                loader,
+                func.ast,
+                func.spec,
+                stack.push(),
+                prerequisite_patterns,
+                reference_patterns,
+                target_patterns,
+                summaries,
+                prefilter,
+            )
+    finally:
+        complete = summaries.leave()
+        referenced = summaries.referenced.pop()
+        names = summaries.reads.pop()
+    for origin in origins:
+        loader.record(origin)
+    summaries.referenced[-1].update(referenced)
+    summaries.reads[-1].update(names)
+    if complete:
+        summaries.put(func.ast, stack, names, pre, ref, tar, origins, referenced)
+    return pre, ref, tar
+
+
+# node types that hold statements sharing the scope of their parent statement
+STATEMENT_CONTAINERS = (ast.stmt, ast.excepthandler) + (
+    (ast.match_case,) if hasattr(ast, "match_case") else ()
+)
+# statements whose bodies don't share the scope of the statement they appear in
+SCOPED_STATEMENTS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# node type -> names of fields that may hold child nodes
+_child_fields: typing.Dict[type, typing.Tuple[str, ...]] = dict()
+
+
+def child_fields(node_type: type) -> typing.Tuple[str, ...]:
+    fields = _child_fields.get(node_type)
+    if fields is None:
+        fields = tuple(k for k in node_type._fields if k != "ctx")
+        _child_fields[node_type] = fields
+    return fields
+
+
 def scan(
     loader: Loader,
     node: ast.AST,
     spec: ModuleSpec,
     stack: Stack,
-    prerequisite_patterns: typing.List[ExprPattern],
-    reference_patterns: typing.List[ExprPattern],
-    target_patterns: typing.List[ExprPattern],
+    prerequisite_patterns: PatternIndex,
+    reference_patterns: PatternIndex,
+    target_patterns: PatternIndex,
+    summaries: typing.Union[FunctionSummaries, None] = None,
+    prefilter: typing.Union[Prefilter, None] = None,
 ) -> typing.Tuple[typing.List[str], typing.List[str], typing.List[str]]:
+    """Finds dependencies in the body of node.
+
+    Nodes are visited once, depth-first in source order. Statements are added
+    to the scope as they are reached, including those nested in compound
+    statements, so later expressions can refer to them. Calls that match a
+    pattern are not followed into the function they call, but their arguments
+    are still looked into. Bodies of nested functions and classes are looked
+    into without adding to the scope.
+
+    If prefilter tells that no call in node can match a pattern, calls are
+    only followed into the functions they call. The body is still scanned
+    because names in called functions are resolved against this scope.
+    """
+    if summaries is None:
+        summaries = FunctionSummaries()
+    test_patterns = prefilter is None or prefilter.may_match(spec.origin, node)
     prerequisites, references, targets = [], [], []
-    for stmt in node.body:
-        loader.populate_scope(spec, stack, node, stmt)
-        for t in ast.walk(stmt):
-            if isinstance(t, ast.Call):
-                if scan_patterns(stack, t, target_patterns, targets):
-                    continue
-                if scan_patterns(stack, t, prerequisite_patterns, prerequisites):
-                    continue
-                if scan_patterns(stack, t, reference_patterns, references):
-                    continue
 
-                func = stack.dereference(t.func)
-                if func is None or not isinstance(func.ast, ast.FunctionDef):
-                    continue
-                pre, ref, tar = scan(
-                    loader,
-                    func.ast,
-                    func.spec,
-                    stack.push(),
-                    prerequisite_patterns,
-                    reference_patterns,
-                    target_patterns,
+    def scan_expr(expr: ast.AST):
+        pending = [expr]
+        while pending:
+            t = pending.pop()
+            if type(t) is ast.Call:
+                matched = test_patterns and (
+                    scan_patterns(stack, t, target_patterns, targets)
+                    or scan_patterns(stack, t, prerequisite_patterns, prerequisites)
+                    or scan_patterns(stack, t, reference_patterns, references)
                 )
-                prerequisites = prerequisites + pre
-                references = references + ref
-                targets = targets + tar
+                func = stack.dereference(t.func)
+                if (
+                    not matched
+                    and func is not None
+                    and isinstance(func.ast, ast.FunctionDef)
+                ):
+                    pre, ref, tar = scan_function(
+                        loader,
+                        func,
+                        stack,
+                        prerequisite_patterns,
+                        reference_patterns,
+                        target_patterns,
+                        summaries,
+                        prefilter,
+                    )
+                    prerequisites.extend(pre)
+                    references.extend(ref)
+                    targets.extend(tar)
+            elif (type(t) is ast.Name or type(t) is ast.Attribute) and type(
+                t.ctx
+            ) is ast.Load:
+                value = stack.dereference(t)
+                if isinstance(value, Node):
+                    summaries.referenced[-1].add(value.spec.origin)
+            for k in reversed(child_fields(type(t))):
+                v = getattr(t, k, None)
+                if type(v) is list:
+                    for item in reversed(v):
+                        if isinstance(item, ast.AST):
+                            pending.append(item)
+                elif isinstance(v, ast.AST):
+                    pending.append(v)
+
+    def scan_statement(t: ast.AST, parent: ast.AST):
+        if isinstance(t, ast.stmt):
+            loader.populate_scope(spec, stack, parent, t)
+        if isinstance(t, SCOPED_STATEMENTS):
+            scan_expr(t)
+            return
+        for k in child_fields(type(t)):
+            v = getattr(t, k, None)
+            if type(v) is list:
+                for item in v:
+                    if isinstance(item, STATEMENT_CONTAINERS):
+                        scan_statement(item, t)
+                    elif isinstance(item, ast.AST):
+                        scan_expr(item)
+            elif isinstance(v, ast.AST):
+                scan_expr(v)
+
+    for stmt in node.body:
+        scan_statement(stmt, node)
     return prerequisites, references, targets
@@ -84,6 +84,26 @@ class DepsFinderTestCase(ASTMixin, TempDirMixin, TestCase):
 
         self.assertIsNone(loader.find_spec("b.d"))
 
+    def test_find_spec_memo(self):
+        loader = Loader([self._dir.name])
+        self.write_file("a.py", ["a = 1"])
+        self.write_file("b/__init__.py", [""])
+        self.write_file("b/c.py", ["b = r'abc'"])
+
+        for _ in range(3):
+            self.assertEqual(loader.find_spec("b.c").origin, self.file_path("b/c.py"))
+            self.assertIsNone(loader.find_spec("pandas"))
+            self.assertIsNone(loader.find_spec("a.c"))
+        self.assertEqual(
+            (loader.specs.hits, loader.specs.misses, loader.specs.skipped), (10, 5, 2)
+        )
+
+        # modules added later are found once lookups are refreshed
+        self.write_file("pandas.py", ["x = 1"])
+        self.assertIsNone(loader.find_spec("pandas"))
+        loader.refresh()
+        self.assertEqual(loader.find_spec("pandas").origin, self.file_path("pandas.py"))
+
     def test_parse_module_spec(self):
         loader = Loader([self._dir.name])
         self.write_file("a.py", ["a = 1"])
@@ -139,6 +159,15 @@ class DepsFinderTestCase(ASTMixin, TempDirMixin, TestCase):
         self.assertEqual(
             node_b.modules["__init__"].spec.origin, self.file_path("b/__init__.py")
         )
+        # submodules are only loaded once they are looked up
+        self.assertEqual(list(node_b.modules.keys()), ["__init__"])
+        self.assertEqual(sorted(node_b.keys()), ["b", "c", "d"])
+        self.assertEqual(list(node_b.modules.keys()), ["__init__"])
+        self.assertEqual(node_b["d"]["e"].spec.origin, self.file_path("b/d/e.py"))
+        self.assertIn("c", node_b)
+        self.assertNotIn("f", node_b)
+        self.assertIsNone(node_b.get("f"))
+        self.assertEqual(node_b.get("c").spec.origin, self.file_path("b/c.py"))
         self.assertObjectEqual(
             node_b,
             Package(
@@ -703,10 +732,128 @@ class DepsFinderTestCase(ASTMixin, TempDirMixin, TestCase):
             [ExprPattern.from_str(r'json.loads(r".+\.json")')],
             [ExprPattern.from_str(r'`*`.to_csv(r"\w+\.csv")')],
         )
-        self.assertEqual(pre, ["abc.csv", "file_b.csv", "qwe.csv", 'z.csv', 'x.csv'])
+        self.assertEqual(pre, ["abc.csv", "file_b.csv", "qwe.csv", "z.csv", "x.csv"])
         self.assertEqual(ref, ["def.json"])
         self.assertEqual(tar, ["def.csv", "file_c.csv", "asd.csv"])
 
+    def test_repeated_calls(self):
+        loader = Loader([self._dir.name])
+        lines = []
+        for i in range(8):
+            lines += (
+                [
+                    "def helper_%d():" % i,
+                    "  read_csv('helper_%d.csv')" % i,
+                ]
+                + ["  helper_%d()" % (i + 1)] * 3
+                + [""]
+            )
+        lines += (
+            [
+                "def helper_8():",
+                "  return read_csv('leaf.csv')",
+                "",
+                "def load():",
+                "  return read_csv(name)",
+                "",
+                "def inner():",
+                "  return read_csv(path)",
+                "",
+                "def outer():",
+                "  return inner()",
+                "",
+                "if __name__ == '__main__':",
+            ]
+            + ["  helper_0()"] * 100
+            + [
+                "  name = 'a.csv'",
+                "  load()",
+                "  load()",
+                "  name = 'b.csv'",
+                "  load()",
+                "  path = 'c.csv'",
+                "  outer()",
+                "  path = 'd.csv'",
+                "  outer()",
+            ]
+        )
+        self.write_file("a.py", lines)
+        pre, ref, tar = find_dependencies(
+            loader,
+            self.file_path("a.py"),
+            [ExprPattern.from_str(r'read_csv(r"\w+\.csv")')],
+            [],
+            [],
+        )
+
+        def expand(i: int) -> typing.List[str]:
+            if i == 8:
+                return ["leaf.csv"]
+            return ["helper_%d.csv" % i] + expand(i + 1) * 3
+
+        # dependencies of memoized calls are repeated, like those of scanned calls
+        self.assertEqual(
+            pre,
+            expand(0) * 100 + ["a.csv", "a.csv", "b.csv", "c.csv", "d.csv"],
+        )
+
+    def test_calls_nested_in_matched_calls(self):
+        loader = Loader([self._dir.name])
+        self.write_file(
+            "a.py",
+            [
+                "if __name__ == '__main__':",
+                "  save('clean/a.csv', load('raw/a.csv'))",
+                "  save('clean/b.csv', df=load('raw/b.csv'))",
+            ],
+        )
+        pre, ref, tar = find_dependencies(
+            loader,
+            self.file_path("a.py"),
+            [ExprPattern.from_str(r'load(r".+\.csv")')],
+            [],
+            [ExprPattern.from_str(r'save(r".+\.csv")')],
+        )
+        self.assertEqual(pre, ["raw/a.csv", "raw/b.csv"])
+        self.assertEqual(tar, ["clean/a.csv", "clean/b.csv"])
+
+    def test_recursive_calls(self):
+        loader = Loader([self._dir.name])
+        self.write_file(
+            "a.py",
+            [
+                "def walk(n):",
+                "  read_csv('walk.csv')",
+                "  walk(n - 1)",
+                "  ping()",
+                "",
+                "def ping():",
+                "  read_csv('ping.csv')",
+                "  pong()",
+                "",
+                "def pong():",
+                "  read_csv('pong.csv')",
+                "  ping()",
+                "  walk(0)",
+                "",
+                "if __name__ == '__main__':",
+                "  walk(10)",
+                "  pong()",
+            ],
+        )
+        pre, ref, tar = find_dependencies(
+            loader,
+            self.file_path("a.py"),
+            [ExprPattern.from_str(r'read_csv(r"\w+\.csv")')],
+            [],
+            [],
+        )
+        self.assertEqual(
+            pre,
+            ["walk.csv", "ping.csv", "pong.csv"]
+            + ["pong.csv", "ping.csv", "walk.csv", "ping.csv", "pong.csv"],
+        )
+
     def test_load_module_from_the_same_package(self):
         loader = Loader([self._dir.name])
         self.write_file(
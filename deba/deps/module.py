@@ -1,12 +1,27 @@
 import ast
+import collections
+import contextlib
+import logging
 import typing
 import os
+from fnmatch import fnmatchcase
 from importlib.machinery import ModuleSpec, PathFinder
 
 import zope.interface
 from zope.interface.common.collections import IMapping
 from attrs import define, field
 
+from deba.deps.cache import ASTCache
+
+if typing.TYPE_CHECKING:
+    from deba.config import Config
+
+
+logger = logging.getLogger("deba")
+
+# rough number of bytes a parsed module takes in memory per byte of source
+AST_BYTES_PER_SOURCE_BYTE = 30
+
 
 @zope.interface.implementer(IMapping)
 @define
@@ -54,6 +69,10 @@ class Module(object):
     children: typing.Dict[str, Node] = field(factory=dict)
     loaded: bool = field(default=False)
 
+    @property
+    def origin(self) -> str:
+        return self.spec.origin
+
     def __getitem__(self, key):
         return self.children[key]
 
@@ -73,131 +92,207 @@ class Module(object):
         return self.children.values()
 
 
+@zope.interface.implementer(IMapping)
+@define
+class OpaqueModule(object):
+    """Stands in for a module that is never parsed."""
+
+    spec: ModuleSpec
+
+    def __getitem__(self, key):
+        raise KeyError("key %s not found" % key)
+
+    def __contains__(self, key):
+        return False
+
+    def get(self, key, default=None):
+        return default
+
+    def keys(self):
+        return []
+
+    def items(self):
+        return []
+
+    def values(self):
+        return []
+
+
 @zope.interface.implementer(IMapping)
 @define
 class Package(object):
+    """A package whose submodules are only loaded once they are looked up."""
+
     modules: typing.Dict[str, typing.Union[Module, "Package"]] = field(factory=dict)
+    loader: typing.Union["Loader", None] = field(default=None, eq=False, repr=False)
+    search_locations: typing.Union[typing.List[str], None] = field(
+        default=None, eq=False, repr=False
+    )
+    _submodule_names: typing.Union[typing.List[str], None] = field(
+        default=None, init=False, eq=False, repr=False
+    )
 
     def __getitem__(self, key):
         if key in self.modules["__init__"]:
             return self.modules["__init__"][key]
-        return self.modules[key]
+        if key not in self.submodule_names():
+            raise KeyError("key %s not found" % key)
+        return self.submodule(key)
 
     def __contains__(self, key):
         if key in self.modules["__init__"]:
             return True
-        return key in self.modules
+        return key in self.submodule_names()
 
     def get(self, key, default=None):
         if key in self.modules["__init__"]:
             return self.modules["__init__"][key]
-        return self.modules.get(key, default)
+        if key not in self.submodule_names():
+            return default
+        return self.submodule(key)
 
     def keys(self):
         for k in self.modules["__init__"].keys():
             yield k
-        for k in self.modules.keys():
-            if k != "__init__":
-                yield k
+        for k in self.submodule_names():
+            yield k
 
     def items(self):
         for k, v in self.modules["__init__"].items():
             yield k, v
-        for k, v in self.modules.items():
-            if k != "__init__":
-                yield k, v
+        for k in self.submodule_names():
+            yield k, self.submodule(k)
 
     def values(self):
         for k, v in self.modules["__init__"].items():
             yield v
-        for k, v in self.modules.items():
-            if k != "__init__":
-                yield v
+        for k in self.submodule_names():
+            yield self.submodule(k)
 
     @classmethod
     def from_spec(
         cls, loader: "Loader", spec: ModuleSpec, ast: ast.Module
     ) -> "Package":
-        package = Package()
+        package = Package(
+            loader=loader, search_locations=spec.submodule_search_locations
+        )
         package.modules["__init__"] = Module(ast, spec)
-        package.collect_submodules(loader, spec)
         return package
 
-    def collect_submodules(self, loader: "Loader", spec: ModuleSpec):
-        for filename in os.listdir(spec.submodule_search_locations[0]):
-            if filename in ["__init__.py", "__main__.py"]:
-                continue
-            if filename.endswith(".py"):
-                name = trim_suffix(filename, ".py")
-                self.modules[name] = loader.find_module(
-                    name, spec.submodule_search_locations
-                )
-            elif os.path.isdir(
-                os.path.join(spec.submodule_search_locations[0], filename)
-            ) and os.path.exists(
-                os.path.join(
-                    spec.submodule_search_locations[0], filename, "__init__.py"
-                )
-            ):
-                self.modules[filename] = loader.find_module(
-                    filename, spec.submodule_search_locations
-                )
+    def submodule_names(self) -> typing.List[str]:
+        """Returns names of modules and subpackages in this package without loading them."""
+        if self._submodule_names is not None:
+            return self._submodule_names
+        if self.search_locations is None:
+            names = [k for k in self.modules.keys() if k != "__init__"]
+        else:
+            names = []
+            dirpath = self.search_locations[0]
+            for filename in os.listdir(dirpath):
+                if filename in ["__init__.py", "__main__.py"]:
+                    continue
+                if filename.endswith(".py"):
+                    names.append(trim_suffix(filename, ".py"))
+                elif os.path.isdir(os.path.join(dirpath, filename)) and os.path.exists(
+                    os.path.join(dirpath, filename, "__init__.py")
+                ):
+                    names.append(filename)
+        self._submodule_names = names
+        return names
+
+    def submodule(self, name: str) -> typing.Union[Module, "Package", None]:
+        """Loads the submodule with the given name if it hasn't been loaded yet."""
+        if self.loader is None:
+            return self.modules.get(name)
+        if name not in self.modules:
+            self.modules[name] = self.loader.find_module(name, self.search_locations)
+        elif isinstance(self.modules[name], (Module, Package)):
+            self.loader.record(self.modules[name].origin)
+        return self.modules[name]
+
+    @property
+    def origin(self) -> str:
+        return self.modules["__init__"].spec.origin
+
+
+def get_child(node, name: str) -> typing.Union[object, None]:
+    """Returns the child of a module, package or node with the given name."""
+    if node is None:
+        return None
+    return node.get(name, None)
+
+
+@define(init=False)
+class Stack(object):
+    """A chain of scopes, innermost first.
 
+    Scopes are shared between a stack and the stacks pushed onto it, so
+    pushing and popping don't copy anything.
+    """
 
-@define
-class Stack(object):
-    layers: typing.List[typing.Dict[str, object]] = field(factory=lambda: [dict()])
+    scope: typing.Dict[str, object]
+    parent: typing.Union["Stack", None]
+
+    def __init__(
+        self,
+        layers: typing.Union[typing.List[typing.Dict[str, object]], None] = None,
+        parent: typing.Union["Stack", None] = None,
+    ):
+        if layers is None:
+            layers = [dict()]
+        for layer in layers[:-1]:
+            parent = Stack([layer], parent)
+        self.scope = layers[-1] if layers else dict()
+        self.parent = parent
 
     def push(self) -> "Stack":
-        return Stack(self.layers + [dict()])
+        return Stack(None, self)
 
     def pop(self) -> "Stack":
-        return Stack(self.layers[:-1])
+        return self.parent if self.parent is not None else Stack()
 
     def store(self, key: str, node):
-        self.layers[-1][key] = node
+        self.scope[key] = node
 
     def current_scope(self) -> dict:
-        return self.layers[-1].copy()
+        """Returns the innermost scope itself, it must not be stored into afterwards."""
+        return self.scope
 
     def remove(self, key: str):
-        self.layers[-1].pop(key)
+        self.scope.pop(key)
 
     def current_keys(self) -> typing.List[str]:
-        return list(self.layers[-1].keys())
+        return list(self.scope.keys())
+
+    def lookup(self, name: str) -> typing.Union[object, None]:
+        stack = self
+        while stack is not None:
+            if name in stack.scope:
+                return stack.scope.get(name, None)
+            stack = stack.parent
+        return None
 
     def get_value(self, dotted_path: str) -> typing.Union[object, None]:
         parts = dotted_path.split(".")
-        for scope in reversed(self.layers):
-            if parts[0] not in scope:
-                continue
-            for name in parts:
-                if scope is None:
-                    return None
-                node = scope.get(name, None)
-                if node is None:
-                    return None
-                scope = node
-            return node
+        node = self.lookup(parts[0])
+        for name in parts[1:]:
+            node = get_child(node, name)
+        return node
 
     def dereference(self, t: ast.AST) -> typing.Union[Node, None]:
         if isinstance(t, ast.Name):
-            return self.get_value(t.id)
+            return self.lookup(t.id)
         elif isinstance(t, ast.Attribute):
-            stack: typing.List[ast.Attribute] = []
+            attrs: typing.List[str] = []
             expr = t
             while isinstance(expr, ast.Attribute):
-                stack.append(expr)
+                attrs.append(expr.attr)
                 expr = expr.value
             if not isinstance(expr, ast.Name):
                 return None
-            node = self.get_value(expr.id)
-            if node is not None:
-                while len(stack) > 0:
-                    attr = stack.pop()
-                    node = Stack([node]).get_value(attr.attr)
-                    if node is None:
-                        break
+            node = self.lookup(expr.id)
+            while node is not None and attrs:
+                node = get_child(node, attrs.pop())
             return node
 
 
@@ -211,11 +306,95 @@ class ParseError(Exception):
     pass
 
 
+def listdir_names(dirpath: str) -> typing.Set[str]:
+    """Returns names of the entries in a directory without their extensions."""
+    try:
+        return {entry.partition(".")[0] for entry in os.listdir(dirpath)}
+    except OSError:
+        return set()
+
+
+@define
+class SpecIndex(object):
+    """Memoizes module spec lookups, including lookups that found nothing.
+
+    Directory listings are cached as well so that names which can't be found
+    in any of the searched directories, such as third-party or standard library
+    modules, are ruled out without asking PathFinder.
+    """
+
+    # directory -> names of entries without their extensions
+    listings: typing.Dict[str, typing.Set[str]] = field(factory=dict)
+    # (name, search paths) -> spec
+    found: typing.Dict[typing.Tuple, ModuleSpec] = field(factory=dict)
+    # (name, search paths) of lookups that found nothing
+    missing: typing.Set[typing.Tuple] = field(factory=set)
+    hits: int = 0
+    misses: int = 0
+    skipped: int = 0
+
+    def listing(self, dirpath: str) -> typing.Set[str]:
+        names = self.listings.get(dirpath)
+        if names is None:
+            names = self.listings[dirpath] = listdir_names(dirpath)
+        return names
+
+    def find_spec(
+        self, name: str, paths: typing.Tuple[str, ...]
+    ) -> typing.Union[ModuleSpec, None]:
+        key = (name, paths)
+        spec = self.found.get(key)
+        if spec is not None or key in self.missing:
+            self.hits += 1
+            return spec
+        self.misses += 1
+        if not any(name in self.listing(dirpath) for dirpath in paths):
+            self.skipped += 1
+        else:
+            spec = PathFinder.find_spec(name, list(paths))
+        if spec is None:
+            self.missing.add(key)
+        else:
+            self.found[key] = spec
+        return spec
+
+    def clear(self):
+        self.listings.clear()
+        self.found.clear()
+        self.missing.clear()
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        return "%d module lookups, %d memoized (%.0f%%), %d ruled out by listing" % (
+            lookups,
+            self.hits,
+            100 * self.hits / lookups if lookups else 0,
+            self.skipped,
+        )
+
+
 @define
 class Loader(object):
     paths: typing.List[str]
     module_asts: typing.Dict[str, ast.Module] = field(factory=dict)
     module_nodes: typing.Dict = field(factory=dict)
+    module_stats: typing.Dict[str, typing.Tuple[int, int]] = field(factory=dict)
+    cache: typing.Union[ASTCache, None] = field(default=None)
+    # origin -> origins of modules found while loading that module
+    module_deps: typing.Dict[str, typing.Set[str]] = field(factory=dict)
+    # origin -> lookups made while loading that module, see record_lookup
+    module_lookups: typing.Dict[str, typing.Set[typing.Tuple]] = field(factory=dict)
+    _traces: typing.List[typing.Set[str]] = field(factory=list)
+    _lookup_traces: typing.List[typing.Set[typing.Tuple]] = field(factory=list)
+    specs: SpecIndex = field(factory=SpecIndex)
+    # estimated memory budget in bytes for parsed modules, None means unbounded
+    max_memory: typing.Union[int, None] = field(default=None)
+    # origin -> estimated memory of parsed modules, least recently used first
+    _lru: typing.Dict[str, int] = field(factory=collections.OrderedDict)
+    _memory: int = field(default=0)
+    # globs of module names and absolute paths of modules that are never parsed
+    opaque_modules: typing.List[str] = field(factory=list)
+    opaque_paths: typing.List[str] = field(factory=list)
 
     def find_spec(
         self,
@@ -223,30 +402,121 @@ class Loader(object):
         parent_module_paths: typing.Union[typing.List[str], None] = None,
     ) -> typing.Union[ModuleSpec, None]:
         parts = module_name.split(".")
-        paths = list(
-            set(
+        paths = tuple(
+            dict.fromkeys(
                 self.paths
                 if parent_module_paths is None
-                else parent_module_paths + self.paths
+                else list(parent_module_paths) + self.paths
             )
         )
         for name in parts:
-            spec = PathFinder.find_spec(name, paths)
+            self.record_lookup(name, paths)
+            spec = self.specs.find_spec(name, paths)
             if spec is None:
                 return None
-            paths = getattr(spec, "submodule_search_locations", [])
+            paths = tuple(getattr(spec, "submodule_search_locations", None) or [])
         return spec
 
+    def module_name(self, origin: str) -> str:
+        """Returns the dotted name of the module at origin, relative to its search path."""
+        origin = trim_suffix(origin, ".py")
+        rel_path = None
+        # the innermost search path is the one a module is imported from
+        for path in self.paths:
+            candidate = os.path.relpath(origin, path)
+            if candidate.startswith(os.pardir):
+                continue
+            if rel_path is None or len(candidate) < len(rel_path):
+                rel_path = candidate
+        if rel_path is None:
+            rel_path = os.path.basename(origin)
+        return trim_suffix(rel_path.replace(os.sep, "."), ".__init__")
+
+    def is_opaque(self, spec: ModuleSpec) -> bool:
+        for path in self.opaque_paths:
+            if spec.origin == path or spec.origin.startswith(path + os.sep):
+                return True
+        if self.opaque_modules:
+            parts = self.module_name(spec.origin).split(".")
+            for idx in range(1, len(parts) + 1):
+                name = ".".join(parts[:idx])
+                for pattern in self.opaque_modules:
+                    if fnmatchcase(name, pattern):
+                        return True
+        return False
+
     def parse_ast(self, origin: str) -> ast.Module:
         if origin in self.module_asts:
             return self.module_asts[origin]
-        with open(origin, "r") as f:
+        with open(origin, "rb") as f:
+            st = os.fstat(f.fileno())
+            content = f.read()
+        root = None
+        if self.cache is not None:
+            key = self.cache.key(content)
+            root = self.cache.load(key)
+        if root is None:
             try:
-                root = ast.parse(f.read(), os.path.split(origin)[-1])
+                root = ast.parse(content, os.path.split(origin)[-1])
             except Exception as e:
                 raise ParseError("error parsing %s" % origin, e)
-            self.module_asts[origin] = root
-            return root
+            if self.cache is not None:
+                self.cache.save(key, root)
+        self.module_asts[origin] = root
+        self.module_stats[origin] = (st.st_mtime_ns, st.st_size)
+        self._lru[origin] = st.st_size * AST_BYTES_PER_SOURCE_BYTE
+        self._memory += self._lru[origin]
+        return root
+
+    def drop(self, origin: str):
+        """Forgets the parsed module at origin, it is parsed again once needed."""
+        self.module_asts.pop(origin, None)
+        self.module_stats.pop(origin, None)
+        self.module_nodes.pop(origin, None)
+        self._memory -= self._lru.pop(origin, 0)
+
+    def evict(self, *done: str):
+        """Drops least recently used modules until parsed modules fit max_memory.
+
+        Modules in done, such as scripts that have just been analyzed, are
+        dropped first. Modules are only forgotten by the loader, scopes of
+        modules that are kept may still refer to them.
+        """
+        if self.max_memory is None:
+            return
+        for origin in done:
+            if origin in self._lru:
+                self._lru.move_to_end(origin, last=False)
+        while self._memory > self.max_memory and self._lru:
+            origin = next(iter(self._lru))
+            logger.debug("evicting %s", origin)
+            self.drop(origin)
+
+    def refresh(self) -> bool:
+        """Drops cached modules whose source files changed since they were parsed.
+
+        Module scopes may hold nodes resolved from other modules, therefore all
+        module nodes are dropped if any file changed. Module lookups are always
+        forgotten since modules may have been added or removed. Returns True if
+        anything was dropped.
+        """
+        self.specs.clear()
+        stale = []
+        for origin, stat in self.module_stats.items():
+            try:
+                st = os.stat(origin)
+            except OSError:
+                stale.append(origin)
+                continue
+            if (st.st_mtime_ns, st.st_size) != stat:
+                stale.append(origin)
+        for origin in stale:
+            self.drop(origin)
+        if stale:
+            self.module_nodes.clear()
+            self.module_deps.clear()
+            self.module_lookups.clear()
+        return len(stale) > 0
 
     def find_module(
         self,
@@ -257,18 +527,82 @@ class Loader(object):
         if spec is None or spec.origin is None or spec.origin.endswith(".pyc"):
             return None
         if spec.origin in self.module_nodes:
-            return self.module_nodes[spec.origin]
-        mod = self.parse_ast(spec.origin)
-        if os.path.split(spec.origin)[-1] == "__init__.py":
-            node = Package.from_spec(self, spec, mod)
-            self.module_nodes[spec.origin] = node
-            self.populate_module_scope(node.modules["__init__"])
-        else:
-            node = Module(mod, spec)
+            node = self.module_nodes[spec.origin]
+            if not isinstance(node, OpaqueModule):
+                self.record(spec.origin)
+            return node
+        if self.is_opaque(spec):
+            logger.debug("not parsing opaque module %s", spec.origin)
+            node = OpaqueModule(spec)
             self.module_nodes[spec.origin] = node
-            self.populate_module_scope(node)
+            return node
+        self.record(spec.origin)
+        mod = self.parse_ast(spec.origin)
+        with self.trace() as deps, self.trace_lookups() as lookups:
+            if os.path.split(spec.origin)[-1] == "__init__.py":
+                node = Package.from_spec(self, spec, mod)
+                self.module_nodes[spec.origin] = node
+                self.populate_module_scope(node.modules["__init__"])
+            else:
+                node = Module(mod, spec)
+                self.module_nodes[spec.origin] = node
+                self.populate_module_scope(node)
+        self.module_deps[spec.origin] = deps
+        self.module_lookups[spec.origin] = lookups
         return node
 
+    def record(self, origin: str):
+        """Records that the module at origin was used by whatever is being traced."""
+        if self._traces:
+            self._traces[-1].add(origin)
+        if origin in self._lru:
+            self._lru.move_to_end(origin)
+
+    @contextlib.contextmanager
+    def trace(self) -> typing.Iterator[typing.Set[str]]:
+        """Collects origins of modules found within this context."""
+        origins = set()
+        self._traces.append(origins)
+        try:
+            yield origins
+        finally:
+            self._traces.pop()
+
+    def record_lookup(self, name: str, paths: typing.Iterable[str]):
+        """Records that a module named name was searched for in paths.
+
+        A lookup is recorded as (directory, name, whether the directory had an
+        entry with that name) for each searched directory, so that modules
+        added or removed later, which would change what the lookup finds, can
+        be noticed.
+        """
+        if self._lookup_traces:
+            lookups = self._lookup_traces[-1]
+            for dirpath in paths:
+                lookups.add((dirpath, name, name in self.specs.listing(dirpath)))
+
+    @contextlib.contextmanager
+    def trace_lookups(self) -> typing.Iterator[typing.Set[typing.Tuple]]:
+        """Collects module lookups made within this context."""
+        lookups = set()
+        self._lookup_traces.append(lookups)
+        try:
+            yield lookups
+        finally:
+            self._lookup_traces.pop()
+
+    def dependencies(self, origins: typing.Iterable[str]) -> typing.Set[str]:
+        """Returns origins together with every module they transitively depend on."""
+        results = set()
+        stack = list(origins)
+        while stack:
+            origin = stack.pop()
+            if origin in results:
+                continue
+            results.add(origin)
+            stack.extend(self.module_deps.get(origin, ()))
+        return results
+
     def populate_module_scope(self, mod: Module):
         if mod.loaded:
             return
@@ -305,7 +639,7 @@ class Loader(object):
                 node = self.find_module(stmt.module, spec.submodule_search_locations)
             if node is not None:
                 for alias in stmt.names:
-                    value = Stack([node]).get_value(alias.name)
+                    value = get_child(node, alias.name)
                     if value is not None:
                         stack.store(
                             alias.name if alias.asname is None else alias.asname,
@@ -361,3 +695,15 @@ class Loader(object):
             return Node(node, spec)
         else:
             return stack.dereference(node)
+
+
+def new_loader(conf: "Config", max_memory: typing.Union[int, None] = None) -> Loader:
+    """Creates a Loader that searches and caches modules as configured."""
+    opaque = conf.opaque
+    return Loader(
+        conf.script_search_paths,
+        cache=ASTCache(conf.cache_dir),
+        max_memory=max_memory,
+        opaque_modules=[] if opaque is None else list(opaque.modules or []),
+        opaque_paths=[] if opaque is None else opaque.abs_paths(conf._root_dir),
+    )
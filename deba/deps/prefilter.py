@@ -0,0 +1,125 @@
+import ast
+import bisect
+import logging
+import re
+import typing
+
+from attrs import define, field
+
+from deba.deps.expr import ExprPattern
+
+
+logger = logging.getLogger("deba")
+
+
+def glob_regex(pat: str) -> str:
+    """Translates a backtick glob into a regular expression over identifiers."""
+    parts = []
+    i = 0
+    while i < len(pat):
+        c = pat[i]
+        i += 1
+        if c == "*":
+            parts.append(r"\w*")
+        elif c == "?":
+            parts.append(r"\w")
+        elif c == "[":
+            j = pat.find("]", i + 1 if i < len(pat) and pat[i] in "!]" else i)
+            if j == -1:
+                parts.append(re.escape(c))
+                continue
+            content = pat[i:j]
+            i = j + 1
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            parts.append("[%s]" % content.replace("\\", "\\\\"))
+        else:
+            parts.append(re.escape(c))
+    return "".join(parts)
+
+
+def callee_regex(pattern: ExprPattern) -> typing.Union[str, None]:
+    """Returns a regular expression that the callee name of any match contains.
+
+    Returns None if the callee of the pattern could be anything.
+    """
+    func = pattern.node.func
+    if isinstance(func, ast.Attribute):
+        return re.escape(func.attr)
+    if not isinstance(func, ast.Name):
+        return None
+    m = ExprPattern.backtick_name_pat.match(func.id)
+    if m is None:
+        return re.escape(func.id)
+    regex = glob_regex(pattern.patterns[int(m.group(1))])
+    if re.fullmatch(r"(\\w\*)+", regex):
+        return None
+    return regex
+
+
+@define
+class Prefilter(object):
+    """Tells which bodies can't contain a call that matches any pattern.
+
+    A call can only match a pattern if the callee name of the pattern appears
+    on one of the lines of the call. Source files are searched for these names
+    line by line, without parsing them.
+    """
+
+    regex: typing.Pattern = field()
+    # origin -> sorted numbers of lines that contain a callee name
+    hit_lines: typing.Dict[str, typing.List[int]] = field(factory=dict)
+    bodies: int = 0
+    skipped: int = 0
+
+    @classmethod
+    def from_patterns(
+        cls, patterns: typing.Iterable[ExprPattern]
+    ) -> typing.Union["Prefilter", None]:
+        """Returns a Prefilter for patterns, or None if they could match any call."""
+        regexes = []
+        for pat in patterns:
+            regex = callee_regex(pat)
+            if regex is None:
+                logger.info(
+                    "prefilter disabled, pattern %s matches any callee", pat.text
+                )
+                return None
+            regexes.append(regex)
+        if not regexes:
+            return None
+        return cls(
+            re.compile((r"\b(?:%s)\b" % "|".join(sorted(set(regexes)))).encode("utf-8"))
+        )
+
+    def lines(self, origin: str) -> typing.List[int]:
+        lines = self.hit_lines.get(origin)
+        if lines is None:
+            with open(origin, "rb") as f:
+                content = f.read()
+            lines = [
+                lineno
+                for lineno, line in enumerate(content.splitlines(), 1)
+                if self.regex.search(line) is not None
+            ]
+            self.hit_lines[origin] = lines
+        return lines
+
+    def may_match(self, origin: typing.Union[str, None], node: ast.AST) -> bool:
+        """Tells whether calls within node, which comes from origin, could match."""
+        if origin is None:
+            return True
+        self.bodies += 1
+        lines = self.lines(origin)
+        end_lineno = getattr(node, "end_lineno", None)
+        idx = bisect.bisect_left(lines, node.lineno)
+        if idx < len(lines) and (end_lineno is None or lines[idx] <= end_lineno):
+            return True
+        self.skipped += 1
+        return False
+
+    def summary(self) -> str:
+        return "prefilter skipped pattern tests in %d of %d bodies" % (
+            self.skipped,
+            self.bodies,
+        )
@@ -0,0 +1,115 @@
+import ast
+import re
+from unittest import TestCase
+
+from deba.deps.expr import ExprPattern
+from deba.deps.find import find_dependencies
+from deba.deps.module import Loader
+from deba.deps.prefilter import Prefilter, glob_regex
+from deba.test_utils import TempDirMixin
+
+
+class PrefilterTestCase(TempDirMixin, TestCase):
+    def test_glob_regex(self):
+        for pat, matches, non_matches in [
+            ("save_*", ["save_", "save_csv"], ["save", "save-csv"]),
+            ("load_?", ["load_a"], ["load_", "load_ab"]),
+            ("to_[cj]sv", ["to_csv", "to_jsv"], ["to_tsv"]),
+            ("to_[!c]sv", ["to_tsv"], ["to_csv"]),
+            ("a.b", ["a.b"], ["axb"]),
+        ]:
+            regex = re.compile(glob_regex(pat))
+            for s in matches:
+                self.assertIsNotNone(regex.fullmatch(s), (pat, s))
+            for s in non_matches:
+                self.assertIsNone(regex.fullmatch(s), (pat, s))
+
+    def test_from_patterns(self):
+        self.assertIsNone(Prefilter.from_patterns([]))
+        self.assertIsNone(
+            Prefilter.from_patterns(
+                [
+                    ExprPattern.from_str(r'read_csv(".+\\.csv")'),
+                    ExprPattern.from_str(r'`*`(".+\\.csv")'),
+                ]
+            )
+        )
+        prefilter = Prefilter.from_patterns(
+            [
+                ExprPattern.from_str(r'read_csv(".+\\.csv")'),
+                ExprPattern.from_str(r'`*`.to_csv(".+\\.csv")'),
+                ExprPattern.from_str(r'`load_*`(".+\\.json")'),
+            ]
+        )
+        self.write_file(
+            "a.py",
+            [
+                "def f():",
+                "    return 1",
+                "",
+                "def g(df):",
+                "    df.to_csv(",
+                "        'a.csv')",
+                "",
+                "def h():",
+                "    load_json('a.json')",
+                "",
+                "def i():",
+                "    reload_json('a.json')",
+                "",
+            ],
+        )
+        filepath = self.file_path("a.py")
+        with open(filepath, "r") as f:
+            funcs = ast.parse(f.read()).body
+        self.assertEqual(
+            [prefilter.may_match(filepath, func) for func in funcs],
+            [False, True, True, False],
+        )
+        self.assertEqual(prefilter.hit_lines, {filepath: [5, 9]})
+        self.assertEqual((prefilter.bodies, prefilter.skipped), (4, 2))
+
+    def test_find_dependencies(self):
+        self.write_file(
+            "lib.py",
+            [
+                "def load():",
+                "    return read_csv(input_name)",
+                "",
+                "def save():",
+                "    df.to_csv(output_name)",
+                "",
+                "def clean():",
+                "    df.dropna(inplace=True)",
+                "    save()",
+                "",
+            ],
+        )
+        self.write_file(
+            "a.py",
+            [
+                "from lib import load, save, clean",
+                "",
+                "if __name__ == '__main__':",
+                "    input_name = 'a_input.csv'",
+                "    output_name = 'a_output.csv'",
+                "    df = load()",
+                "    clean()",
+            ],
+        )
+        patterns = (
+            [ExprPattern.from_str(r'read_csv(r".+\.csv")')],
+            [],
+            [ExprPattern.from_str(r'`*`.to_csv(r".+\.csv")')],
+        )
+        prefilter = Prefilter.from_patterns([pat for pats in patterns for pat in pats])
+        results = [
+            find_dependencies(
+                Loader([self._dir.name]), self.file_path("a.py"), *patterns, **kwargs
+            )
+            for kwargs in [dict(), dict(prefilter=prefilter)]
+        ]
+        self.assertEqual(results[0], (["a_input.csv"], [], ["a_output.csv"]))
+        self.assertEqual(results[1], results[0])
+        # the main block and clean don't mention read_csv or to_csv
+        self.assertEqual((prefilter.bodies, prefilter.skipped), (4, 2))
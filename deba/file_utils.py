@@ -0,0 +1,20 @@
+import os
+
+
+def write_if_changed(filepath: str, content: str) -> bool:
+    """Writes content to filepath unless it already holds it, keeping its mtime.
+
+    Returns True if the file was written.
+    """
+    try:
+        with open(filepath, "r") as f:
+            if f.read() == content:
+                return False
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    tmp_filepath = "%s.%d.tmp" % (filepath, os.getpid())
+    with open(tmp_filepath, "w") as f:
+        f.write(content)
+    os.replace(tmp_filepath, filepath)
+    return True
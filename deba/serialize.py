@@ -52,8 +52,12 @@ def yaml_dump(data, **kwargs) -> str:
     return yaml.dump(data, Dumper=Dumper, **kwargs)
 
 
+# use libyaml bindings when PyYAML was built with them
+_Loader = getattr(yaml, "CLoader", yaml.Loader)
+
+
 def yaml_load(s, serializer_cls):
-    data = yaml.load(s, Loader=yaml.Loader)
+    data = yaml.load(s, Loader=_Loader)
     return _deserialize(data, serializer_cls)
 
 